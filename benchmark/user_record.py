@@ -0,0 +1,32 @@
+"""Memory benchmark of the in-memory user data
+
+Compare the legacy `dict[str, dict[str, str]]` representation with `dict[str, UserRecord]`.
+
+Usage: python -m benchmark.user_record [users]
+"""
+import sys
+import tracemalloc
+from utility.database import UserRecord
+
+def makeCookie(i: int) -> str:
+    return f'ltoken={"a" * 32}{i:08d} ltuid={100000000 + i} cookie_token={"b" * 32}{i:08d} account_id={100000000 + i}'
+
+def measure(build) -> int:
+    """Bytes allocated by `build()` that are still alive afterwards"""
+    tracemalloc.start()
+    data = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return current
+
+def main(count: int = 100000) -> None:
+    user_ids = [str(100000000000000000 + i) for i in range(count)]
+    legacy = measure(lambda: {user_id: {'cookie': makeCookie(i), 'uid': str(800000000 + i)} for i, user_id in enumerate(user_ids)})
+    records = measure(lambda: {user_id: UserRecord.fromCookie(makeCookie(i), 800000000 + i) for i, user_id in enumerate(user_ids)})
+    print(f'{count} users')
+    print(f'dict[str, dict[str, str]]: {legacy / 1024 / 1024:8.2f} MiB ({legacy / count:.0f} B/user)')
+    print(f'dict[str, UserRecord]:     {records / 1024 / 1024:8.2f} MiB ({records / count:.0f} B/user)')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
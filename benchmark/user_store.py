@@ -0,0 +1,48 @@
+"""Micro-benchmark of the user store write latency
+
+Compare the legacy whole-file JSON rewrite with the SQLite (WAL) per-row upsert
+when the store already holds 1k / 10k / 100k users.
+
+Usage: python -m benchmark.user_store [writes]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+from utility.database import JsonUserStore, SQLiteUserStore, UserRecord
+
+COOKIE = 'ltoken=' + 'a' * 40 + ' ltuid=123456789 cookie_token=' + 'b' * 40 + ' account_id=123456789'
+
+def makeUsers(count: int) -> dict:
+    return {str(100000000000000000 + i): UserRecord.fromCookie(COOKIE, 800000000 + i) for i in range(count)}
+
+def measure(store, users: dict, writes: int) -> float:
+    """Average latency (ms) of a single-user write"""
+    user_ids = list(users.keys())
+    start = time.perf_counter()
+    for i in range(writes):
+        user_id = user_ids[(i * 7919) % len(user_ids)]
+        store.upsert(user_id, users[user_id])
+    return (time.perf_counter() - start) / writes * 1000
+
+def main(writes: int = 50) -> None:
+    print(f'{"users":>8} {"json (ms/write)":>16} {"sqlite (ms/write)":>18}')
+    for count in (1000, 10000, 100000):
+        users = makeUsers(count)
+        with tempfile.TemporaryDirectory() as tmp:
+            json_filename = os.path.join(tmp, 'user_data.json')
+            with open(json_filename, 'w', encoding='utf-8') as f:
+                json.dump({user_id: record.toDict() for user_id, record in users.items()}, f)
+            json_store = JsonUserStore(json_filename)
+            json_store.load()
+            json_ms = measure(json_store, users, writes)
+
+            sqlite_store = SQLiteUserStore(os.path.join(tmp, 'genshin.db'))
+            sqlite_store.upsertMany(users.items())
+            sqlite_ms = measure(sqlite_store, users, writes)
+            sqlite_store.close()
+        print(f'{count:>8} {json_ms:>16.3f} {sqlite_ms:>18.3f}')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
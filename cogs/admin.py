@@ -6,6 +6,7 @@ from discord.ext import commands, tasks
 from pathlib import Path
 from utility.utils import log
 from utility.config import config
+from utility.metrics import metrics
 
 class Admin(commands.Cog):
     def __init__(self, bot):
@@ -53,7 +54,8 @@ class Admin(commands.Cog):
     @app_commands.choices(option=[
         Choice(name='Delay', value=0),
         Choice(name='Number of connected servers', value=1),
-        Choice(name='connected server name', value=2)])
+        Choice(name='connected server name', value=2),
+        Choice(name='Metrics', value=3)])
     async def status(self, interaction: discord.Interaction, option: int):
         if option == 0:
             await interaction.response.send_message(f'Delay:{round(self.bot.latency*1000)} millisecond')
@@ -66,6 +68,9 @@ class Admin(commands.Cog):
                 msg = '、'.join(names[i : i + 100])
                 embed = discord.Embed(title=f'connected server name({i + 1})', description=msg)
                 await interaction.followup.send(embed=embed)
+        elif option == 3:
+            summary = metrics.summary()
+            await interaction.response.send_message(embed=discord.Embed(title='Metrics', description=f'```{summary[:4000] or "No data"}```'))
     
     # Use system commands
     @app_commands.command(name='system', description='Use system commands')
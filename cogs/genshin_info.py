@@ -8,10 +8,12 @@ from discord import app_commands
 from discord.ext import commands
 from discord.app_commands import Choice
 from utility.GenshinApp import genshin_app
-from utility.draw import drawRecordCard, drawAbyssCard
+from utility.draw import drawRecordCardBackground, drawRecordCardAvatar, drawRecordCardStats, drawAbyssCard
 from utility.utils import log
 from utility.config import config
 from utility.emoji import emoji
+from utility.roster import CharacterSummary
+from utility.pipeline import Pipeline
 from utility import Enka
 
 class GenshinInfo(commands.Cog, name='Genshin_Impact_Information'):
@@ -22,8 +24,11 @@ class GenshinInfo(commands.Cog, name='Genshin_Impact_Information'):
     @app_commands.command(
         name='notes',
         description='Real-Time Notes is here for Resin, Realm currency, exploration dispatch and many more.')
-    async def slash_notes(self, interaction: discord.Interaction):
-        result = await genshin_app.getRealtimeNote(str(interaction.user.id))
+    @app_commands.rename(refresh='refresh')
+    @app_commands.describe(refresh='Fetch the latest notes from Hoyolab instead of the recent estimate')
+    @app_commands.choices(refresh=[Choice(name='Yes', value=1), Choice(name='No', value=0)])
+    async def slash_notes(self, interaction: discord.Interaction, refresh: int = 0):
+        result = await genshin_app.getRealtimeNote(str(interaction.user.id), force_refresh=bool(refresh))
         if isinstance(result, str):
             await interaction.response.send_message(result)
         else:
@@ -105,17 +110,26 @@ class GenshinInfo(commands.Cog, name='Genshin_Impact_Information'):
     @app_commands.checks.cooldown(1, config.slash_cmd_cooldown)
     async def slash_card(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        result = await genshin_app.getRecordCard(str(interaction.user.id))
 
-        if isinstance(result, str):
-            await interaction.edit_original_message(content=result)
-            return
-        
-        avatar_bytes = await interaction.user.display_avatar.read()
-        card = result[0]
-        userstats = result[1]
+        async def fetchRecord():
+            return await genshin_app.getRecordCard(str(interaction.user.id))
+
+        def drawStats(img, result):
+            return result if isinstance(result, str) else drawRecordCardStats(img, *result)
+
+        # The Hoyolab data, the avatar and the background are fetched at the same time,
+        # the avatar is drawn while Hoyolab is still answering
+        pipeline = Pipeline('summary_card') \
+            .add('record', fetchRecord) \
+            .add('avatar', interaction.user.display_avatar.read) \
+            .add('background', drawRecordCardBackground, thread=True) \
+            .add('portrait', drawRecordCardAvatar, after=('background', 'avatar'), thread=True) \
+            .add('card', drawStats, after=('portrait', 'record'), thread=True)
         try:
-            fp = drawRecordCard(avatar_bytes, card, userstats)
+            fp = (await pipeline.run())['card']
+            if isinstance(fp, str):
+                await interaction.edit_original_message(content=fp)
+                return
         except Exception as e:
             log.error(f'[exception][{interaction.user.id}][slash_card]: {e}')
             await interaction.edit_original_message(content='An error occurred, card creation failed')
@@ -131,7 +145,7 @@ class GenshinInfo(commands.Cog, name='Genshin_Impact_Information'):
 
     class CharactersDropdown(discord.ui.Select):
         """Drop-down menu to select role"""
-        def __init__(self, previous_interaction: discord.Interaction, characters: Sequence[genshin.models.Character], index: int = 1):
+        def __init__(self, previous_interaction: discord.Interaction, characters: Sequence[CharacterSummary], index: int = 1):
             options = [discord.SelectOption(
                     label=f'★{character.rarity} Lv.{character.level} {character.name}',
                     value=str(i),
@@ -153,7 +167,7 @@ class GenshinInfo(commands.Cog, name='Genshin_Impact_Information'):
     
     class CharactersDropdownView(discord.ui.View):
         """Displays the View of the role drop-down menu, and divides the menu according to the upper limit of 25 menu fields."""
-        def __init__(self, previous_interaction: discord.Interaction, characters: Sequence[genshin.models.Character]):
+        def __init__(self, previous_interaction: discord.Interaction, characters: Sequence[CharacterSummary]):
             super().__init__(timeout=180)
             max_row = 25
             for i in range(0, len(characters), max_row):
@@ -161,9 +175,12 @@ class GenshinInfo(commands.Cog, name='Genshin_Impact_Information'):
     
     # List of all personal roles
     @app_commands.command(name='my_characters', description='Show all my characters publicly')
-    async def slash_character(self, interaction: discord.Interaction):
+    @app_commands.rename(refresh='refresh')
+    @app_commands.describe(refresh='Fetch the latest characters from Hoyolab instead of the recently saved list')
+    @app_commands.choices(refresh=[Choice(name='Yes', value=1), Choice(name='No', value=0)])
+    async def slash_character(self, interaction: discord.Interaction, refresh: int = 0):
         asyncio.create_task(interaction.response.defer())
-        result = await genshin_app.getCharacters(str(interaction.user.id))
+        result = await genshin_app.getCharacters(str(interaction.user.id), force_refresh=bool(refresh))
 
         if isinstance(result, str):
             await interaction.edit_original_message(content=result)
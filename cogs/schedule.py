@@ -1,31 +1,61 @@
-import json
+import time
+import zlib
+import contextlib
 import asyncio
 import discord
-from datetime import datetime
+import genshin
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
 from discord import app_commands
 from discord.app_commands import Choice
 from discord.ext import commands, tasks
 from utility.config import config
-from utility.utils import log, user_last_use_time
+from utility.utils import log
 from utility.GenshinApp import genshin_app
+from utility.database import SubscriptionStore, JobQueue, ClaimLedger
+from utility.workers import WorkerPool
+from utility.outbox import outbox
+from utility.names import display_names
+from utility.reminders import ReminderQueue
+
+def hoyolabDate() -> str:
+    """The day of the Hoyolab daily rewards, they reset at midnight UTC+8"""
+    return datetime.now(timezone(timedelta(hours=8))).strftime('%Y-%m-%d')
 
 class Schedule(commands.Cog, name='Automation(BETA)'):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.__daily_reward_filename = 'data/schedule_daily_reward.json'
-        self.__resin_notifi_filename = 'data/schedule_resin_notification.json'
-        try:
-            with open(self.__daily_reward_filename, 'r', encoding='utf-8') as f:
-                self.__daily_dict: dict[str, dict[str, str]] = json.load(f)
-        except:
-            self.__daily_dict: dict[str, dict[str, str]] = { }
-        try:
-            with open(self.__resin_notifi_filename, 'r', encoding='utf-8') as f:
-                self.__resin_dict: dict[str, dict[str, str]] = json.load(f)
-        except:
-            self.__resin_dict: dict[str, dict[str, str]] = { }
+        self.__daily = SubscriptionStore('daily', config.database_file, 'data/schedule_daily_reward.json')
+        self.__resin = SubscriptionStore('resin', config.database_file, 'data/schedule_resin_notification.json')
+        
+        # Next resin check of each subscriber, predicted from their notes
+        self.__resin_queue = ReminderQueue()
+        self.__resin_task: Optional[asyncio.Task] = None
+        # Consecutive failed checks of each subscriber, for the retry backoff
+        self.__resin_failures: Dict[str, int] = { }
+        
+        # Persisted daily check-in jobs and the rewards already claimed, so a restarted run resumes where it stopped
+        self.__jobs = JobQueue(config.database_file)
+        self.__ledger = ClaimLedger(config.database_file)
+        self.__daily_date: Optional[str] = None
+        self.__daily_done: Dict[Tuple[str, str], int] = { }
+        self.__daily_task: Optional[asyncio.Task] = None
         
-        self.schedule.start()
+        # When several bot processes share the database, only one of them runs the schedule
+        if config.run_schedule:
+            self.schedule.start()
+            self.__daily_task = asyncio.create_task(self.__dailyRunner())
+            self.__resin_task = asyncio.create_task(self.__resinReminder())
+
+    async def cog_unload(self) -> None:
+        self.schedule.cancel()
+        for task in (self.__daily_task, self.__resin_task):
+            if task != None:
+                task.cancel()
+        # Deliver the results of the interrupted runs
+        await outbox.flush()
+        self.__daily.close()
+        self.__resin.close()
     
     class ChooseGameButton(discord.ui.View):
         """Select the button to automatically sign in to the game"""
@@ -92,7 +122,7 @@ class Schedule(commands.Cog, name='Automation(BETA)'):
              '· Before setting, please confirm that the genshin-lessen has the permission to speak in the channel. If the push message fails, the genshin-lessen will automatically remove the scheduling settings\n'
              '· To change the push channel, please reset the command once on the new channel\n\n'
             f'· Daily check-in: automatic forum check-in between {config.auto_daily_reward_time}~{config.auto_daily_reward_time+1} points every day, please use the `/daily daily check-in` command before setting to confirm that the helper can check in correctly for you\n'
-            f'·Resin reminder: check every two hours, when the resin exceeds {config.auto_check_resin_threshold}, a reminder will be sent. Before setting, please use the `/notes instant note` command to confirm that the assistant can read your resin information\n')
+            f'·Resin reminder: checked when your resin is expected to reach the threshold (at least every {config.resin_recheck_interval / 3600:g} hours), when the resin exceeds {config.auto_check_resin_threshold}, a reminder will be sent. Before setting, please use the `/notes instant note` command to confirm that the assistant can read your resin information\n')
             await interaction.response.send_message(embed=discord.Embed(title='Instructions for using the scheduling function', description=msg))
             return
         
@@ -115,113 +145,250 @@ class Schedule(commands.Cog, name='Automation(BETA)'):
                 await daily_mention_btn.wait()
                 
                 # add user
-                self.__add_user(str(interaction.user.id), str(interaction.channel_id), self.__daily_dict, self.__daily_reward_filename, mention=daily_mention_btn.value)
-                if choose_game_btn.value == 'Genshin + Honkai 3': # Added Honkai Impact 3 users
-                    self.__add_honkai_user(str(interaction.user.id), self.__daily_dict, self.__daily_reward_filename)
+                with self.__daily.batch():
+                    self.__daily.add(str(interaction.user.id), str(interaction.channel_id), mention=daily_mention_btn.value)
+                    if choose_game_btn.value == 'Genshin + Honkai 3': # Added Honkai Impact 3 users
+                        self.__daily.addHonkai(str(interaction.user.id))
                 await interaction.edit_original_message(content=f'{choose_game_btn.value}Daily automatic check-in has been turned on, and when checking in genshin-lessen will{" <:search:987357570308124672>" if daily_mention_btn.value else " not"} tag you', view=None)
             elif switch == 0: # Turn off check-in
-                self.__remove_user(str(interaction.user.id), self.__daily_dict, self.__daily_reward_filename)
+                self.__remove_user(str(interaction.user.id), self.__daily)
                 await interaction.response.send_message('Daily automatic check-in is turned off')
         elif function == 'resin': # Resin full reminder
             if switch == 1: # Turn on the check resin function
-                self.__add_user(str(interaction.user.id), str(interaction.channel_id), self.__resin_dict, self.__resin_notifi_filename)
+                self.__resin.add(str(interaction.user.id), str(interaction.channel_id))
+                self.__resin_queue.schedule(str(interaction.user.id), time.time())
                 await interaction.response.send_message('Resin full reminder is on')
             elif switch == 0: # Turn off check resin function
-                self.__remove_user(str(interaction.user.id), self.__resin_dict, self.__resin_notifi_filename)
+                self.__remove_user(str(interaction.user.id), self.__resin)
                 await interaction.response.send_message('Resin full reminder is off')
 
     loop_interval = 10
     @tasks.loop(minutes=loop_interval)
     async def schedule(self):
         now = datetime.now()
-        # Automatic check-in at {config.auto_daily_reward_time} points every day
-        if now.hour == config.auto_daily_reward_time and now.minute < self.loop_interval:
-            log.info('[schedule][System]schedule: Daily automatic check-in starts')
-            # make a copy to avoid conflicts
-            daily_dict = dict(self.__daily_dict)
-            total, honkai_count = 0, 0
-            for user_id, value in daily_dict.items():
-                channel = self.bot.get_channel(int(value['channel']))
-                has_honkai = False if value.get('honkai') == None else True
-                check, msg = genshin_app.checkUserData(user_id, update_use_time=False)
-                if channel == None or check == False:
-                    self.__remove_user(user_id, self.__daily_dict, self.__daily_reward_filename)
-                    continue
-                result = await genshin_app.claimDailyReward(user_id, honkai=has_honkai, schedule=True)
-                total += 1
-                honkai_count += int(has_honkai)
-                try:
-                    if value.get('mention') == 'False':
-                        user = await self.bot.fetch_user(int(user_id))
-                        await channel.send(f'[automatic check-in] {user.display_name}: {result}')
-                    else:
-                        await channel.send(f'[automatic check-in] <@{user_id}> {result}')
-                except Exception as e:
-                    log.error(f'[schedule][{user_id}]Automatic check-in:{e}')
-                    self.__remove_user(user_id, self.__daily_dict, self.__daily_reward_filename)
-                await asyncio.sleep(config.auto_loop_delay)
-            log.info(f'[schedule][System]schedule: Daily automatic check-in ends, total {total} people sign in, which {honkai_count} People also sign in collapse 3')
-        
-        # Resin checks every two hours and staggered from daily check-in times
-        if abs(now.hour - config.auto_daily_reward_time) % 2 == 1 and now.minute < self.loop_interval:
-            log.info('[schedule][System]schedule: Automatic resin check starts')
-            resin_dict = dict(self.__resin_dict)
-            count = 0
-            for user_id, value in resin_dict.items():
-                channel = self.bot.get_channel(int(value['channel']))
-                check, msg = genshin_app.checkUserData(user_id, update_use_time=False)
-                if channel == None or check == False:
-                    self.__remove_user(user_id, self.__resin_dict, self.__resin_notifi_filename)
-                    continue
-                result = await genshin_app.getRealtimeNote(user_id, schedule=True)
-                count += 1
-                if result != None:
-                    try:
-                        if isinstance(result, str):
-                            await channel.send(f'<@{user_id}>, an error occurred while automatically checking the resin:{result}')
-                        else:
-                            await channel.send(f'<@{user_id}>, The resin is (about to) overflow!', embed=result)
-                    except:
-                        self.__remove_user(user_id, self.__resin_dict, self.__resin_notifi_filename)
-                await asyncio.sleep(config.auto_loop_delay)
-            log.info(f'[schedule][System]schedule: Automatic checking of resin end,{count} person checked')
-        
-        user_last_use_time.save() # Regularly store the last usage time data of the user
         # Daily deletion of outdated user data
         if now.hour == 1 and now.minute < self.loop_interval:
-            genshin_app.deleteExpiredUserData()
+            await genshin_app.deleteExpiredUserData()
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        if before.display_name != after.display_name:
+            display_names.update(after)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        # The name of the user, not the nickname in this server
+        if before.name != after.name and (user := self.bot.get_user(after.id)) != None:
+            display_names.update(user)
 
     @schedule.before_loop
     async def before_schedule(self):
         await self.bot.wait_until_ready()
 
-    def __add_user(self, user_id: str, channel: str, data: dict, filename: str, *, mention: bool = True) -> None:
-        data[user_id] = { }
-        data[user_id]['channel'] = channel
-        if mention == False:
-            data[user_id]['mention'] = 'False'
-        self.__saveScheduleData(data, filename)
-    
-    def __add_honkai_user(self, user_id: str, data: dict, filename: str) -> None:
-        """Join Honkai 3 to sign in to an existing user, please confirm that you already have the user's information before using it"""
-        if data.get(user_id) != None:
-            data[user_id]['honkai'] = 'True'
-            self.__saveScheduleData(data, filename)
+    async def __dailyRunner(self) -> None:
+        """Daily automatic check-in from the persisted job queue.
 
-    def __remove_user(self, user_id: str, data: dict, filename: str) -> None:
+        At {config.auto_daily_reward_time} o'clock (or at startup when the bot was down at that time) every subscriber
+        gets a job spread over `auto_daily_reward_window` seconds by the hash of their ID, so the run does not hit Hoyolab
+        all at once. Jobs left by a restart are picked up again, the claim ledger keeps a resumed run from claiming twice.
+        A check-in that times out or fails is retried `auto_daily_reward_attempts` times before the user is told to check in manually
+        """
+        await self.bot.wait_until_ready()
+        log.info('[schedule][System]dailyRunner: started')
+        while True:
+            try:
+                await self.__materializeDaily()
+                due = await asyncio.to_thread(self.__jobs.due, 'daily', time.time())
+                # Jobs handled in this process whose completion or retry is not written yet
+                due = [job for job in due if self.__daily_done.get((job[0], job[1])) != job[2]]
+                if len(due) == 0:
+                    await asyncio.sleep(30)
+                    continue
+                ledger_date = hoyolabDate()
+                claimed = await asyncio.to_thread(self.__ledger.load, ledger_date)
+                # The Hoyolab rate limiter paces the workers
+                # The timeout applies to the Hoyolab requests of each user, see __checkIn
+                pool = WorkerPool('daily_check_in', config.auto_daily_reward_concurrency)
+                try:
+                    await pool.run(due, lambda job: self.__checkIn(job, ledger_date, claimed))
+                finally:
+                    # Removals during the run are committed once at the end
+                    self.__daily.commit()
+                pending = await asyncio.to_thread(self.__jobs.pending, 'daily')
+                log.info(f'[schedule][System]dailyRunner: {len(due)} jobs run, {pending} left')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'[exception][System]Schedule > __dailyRunner: {e}')
+                await asyncio.sleep(60)
+
+    async def __materializeDaily(self) -> None:
+        """Create the jobs of today's run once its start time has passed"""
+        now = datetime.now()
+        run_date = now.strftime('%Y-%m-%d')
+        if run_date == self.__daily_date or now.hour < config.auto_daily_reward_time:
+            return
+        start = now.replace(hour=config.auto_daily_reward_time, minute=0, second=0, microsecond=0).timestamp()
+        window = max(1, int(config.auto_daily_reward_window))
+        # A stable offset per user, jobs already due when the bot starts late run right away
+        jobs = [(user_id, start + zlib.crc32(user_id.encode('utf-8')) % window) for user_id in list(self.__daily.data.keys())]
+        if await asyncio.to_thread(self.__jobs.materialize, 'daily', run_date, jobs):
+            log.info(f'[schedule][System]dailyRunner: {len(jobs)} check-in jobs of {run_date} spread over {window}s')
+        self.__daily_date = run_date
+        self.__daily_done.clear()
+
+    async def __checkIn(self, job: Tuple[str, str, int], ledger_date: str, claimed: Dict[str, Dict[str, Optional[str]]]) -> None:
+        """Run one job, it is completed only when it returns normally.
+        A cancelled job (the cog is unloaded) stays in the queue as it is, a failed or timed out one is retried later"""
+        user_id, run_date, attempts = job
         try:
-            del data[user_id]
-        except:
-            log.info(f'[exception][System]Schedule > __remove_user(user_id={user_id}): User does not exist')
+            await self.__claimDaily(user_id, ledger_date, claimed)
+        except Exception as e:
+            reason = 'timed out' if isinstance(e, asyncio.TimeoutError) else str(e)
+            if attempts + 1 < config.auto_daily_reward_attempts:
+                log.error(f'[exception][{user_id}]Automatic check-in attempt {attempts + 1}: {reason}, retrying later')
+                self.__daily_done[(user_id, run_date)] = attempts
+                self.__jobs.retry('daily', user_id, run_date, config.auto_daily_reward_retry_delay)
+                return
+            log.error(f'[exception][{user_id}]Automatic check-in attempt {attempts + 1}: {reason}, giving up')
+            await self.__postCheckIn(user_id, 'Automatic check-in failed today, please use /daily_check_in')
+        self.__daily_done[(user_id, run_date)] = attempts
+        self.__jobs.complete('daily', user_id, run_date)
+
+    async def __claimDaily(self, user_id: str, ledger_date: str, claimed: Dict[str, Dict[str, Optional[str]]]) -> None:
+        value = self.__daily.data.get(user_id)
+        if value == None: # unsubscribed since the jobs were created
+            return
+        channel = self.bot.get_channel(int(value['channel']))
+        check, msg = genshin_app.checkUserData(user_id, update_use_time=False)
+        if channel == None or check == False:
+            self.__remove_user(user_id, self.__daily, commit=False)
+            return
+        has_honkai = False if value.get('honkai') == None else True
+        ledger = claimed.setdefault(user_id, { })
+        # Resumed after the results were posted
+        if ClaimLedger.REPORTED in ledger:
+            return
+        wanted = [genshin.Game.GENSHIN] + ([genshin.Game.HONKAI] if has_honkai else [])
+        if all(game.value in ledger for game in wanted):
+            # Resumed after the rewards were claimed but before the results were posted
+            result = ' '.join(ledger[game.value] or 'The reward has been received!' for game in wanted)
         else:
-            self.__saveScheduleData(data, filename)
-    
-    def __saveScheduleData(self, data: dict, filename: str):
+            results = {genshin.Game(game): message for game, message in ledger.items()}
+            try:
+                async with self.__waitUpstream(user_id):
+                    result = await asyncio.wait_for(
+                        genshin_app.claimDailyReward(user_id, honkai=has_honkai, schedule=True, claimed=results), config.auto_daily_reward_timeout)
+            finally:
+                # Also what was claimed before a timeout, so the retry skips it
+                new_results = {game.value: message for game, message in results.items() if game.value not in ledger}
+                if len(new_results) > 0:
+                    self.__ledger.record(user_id, ledger_date, new_results)
+                    ledger.update(new_results)
+        if await self.__postCheckIn(user_id, result):
+            self.__ledger.markReported(user_id, ledger_date)
+            ledger[ClaimLedger.REPORTED] = None
+
+    async def __postCheckIn(self, user_id: str, result: str) -> bool:
+        """Queue the check-in result for the user's channel, mentioning the user unless they chose not to be pinged.
+        Returns whether the result was queued"""
+        value = self.__daily.data.get(user_id)
+        if value == None or (channel := self.bot.get_channel(int(value['channel']))) == None:
+            return False
+        on_error = lambda: self.__remove_user(user_id, self.__daily)
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f)
-        except:
-            log.error(f'[exception][System]Schedule > __saveScheduleData(filename={filename}): Archive failed')
+            if value.get('mention') == 'False':
+                name = await display_names.resolve(self.bot, int(user_id))
+                outbox.post(channel, f'[automatic check-in] {name}: {result}', on_error=on_error)
+            else:
+                outbox.post(channel, f'[automatic check-in] <@{user_id}> {result}', mention=int(user_id), on_error=on_error)
+        except Exception as e:
+            log.error(f'[schedule][{user_id}]Automatic check-in:{e}')
+            self.__remove_user(user_id, self.__daily, commit=False)
+            return False
+        return True
+
+    async def __resinReminder(self) -> None:
+        """Check the resin of each subscriber when it is predicted to reach the threshold, instead of everyone every two hours"""
+        await self.bot.wait_until_ready()
+        log.info('[schedule][System]resinReminder: started')
+        while True:
+            try:
+                now = time.time()
+                # New subscribers (also the ones added by other bot processes) are checked right away
+                for user_id in list(self.__resin.data.keys()):
+                    if user_id not in self.__resin_queue:
+                        self.__resin_queue.schedule(user_id, now)
+                due = self.__resin_queue.popDue(now)
+                if len(due) > 0:
+                    # The timeout applies to the Hoyolab request of each user, see __checkResin
+                    pool = WorkerPool('resin_reminder', config.auto_check_resin_concurrency, progress_interval=300)
+                    try:
+                        await pool.run(due, self.__checkResin)
+                    finally:
+                        # Removals during the run are committed once at the end
+                        self.__resin.commit()
+                next_due = self.__resin_queue.nextDue()
+                await asyncio.sleep(60 if next_due == None else min(60, max(1, next_due - time.time())))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'[exception][System]Schedule > __resinReminder: {e}')
+                await asyncio.sleep(60)
+
+    async def __checkResin(self, user_id: str) -> None:
+        value = self.__resin.data.get(user_id)
+        if value == None: # unsubscribed while waiting
+            return
+        channel = self.bot.get_channel(int(value['channel']))
+        check, msg = genshin_app.checkUserData(user_id, update_use_time=False)
+        if channel == None or check == False:
+            self.__remove_user(user_id, self.__resin, commit=False)
+            return
+        next_check: Optional[float] = None
+        try:
+            async with self.__waitUpstream(user_id):
+                result = await asyncio.wait_for(genshin_app.getRealtimeNote(user_id, schedule=True), config.auto_check_resin_timeout)
+            # Check again when the resin reaches the threshold, or after the safety interval in case it was spent or refilled
+            now = time.time()
+            next_check = now + config.resin_recheck_interval
+            if result == None:
+                reach_time = genshin_app.getResinReachTime(user_id, config.auto_check_resin_threshold)
+                if reach_time != None:
+                    # The recovery times are rounded to the minute
+                    next_check = min(next_check, max(now, reach_time) + 60)
+        finally:
+            # A failed or timed out check is retried with a growing delay, not at the next round of the loop
+            if next_check == None:
+                failures = self.__resin_failures.get(user_id, 0) + 1
+                self.__resin_failures[user_id] = failures
+                next_check = time.time() + min(config.resin_recheck_interval, 60 * 2 ** failures)
+            else:
+                self.__resin_failures.pop(user_id, None)
+            if user_id in self.__resin.data:
+                self.__resin_queue.schedule(user_id, next_check)
+            else:
+                self.__resin_failures.pop(user_id, None)
+        if result != None:
+            on_error = lambda: self.__remove_user(user_id, self.__resin)
+            if isinstance(result, str):
+                outbox.post(channel, f'<@{user_id}>, an error occurred while automatically checking the resin:{result}', mention=int(user_id), on_error=on_error)
+            else:
+                outbox.post(channel, f'<@{user_id}>, The resin is (about to) overflow!', embed=result, mention=int(user_id), on_error=on_error)
+
+    @contextlib.asynccontextmanager
+    async def __waitUpstream(self, user_id: str):
+        """Pause the run while the Hoyolab server of the user is down, instead of failing every remaining user.
+        The requests of the user go inside the `async with` block, which may hold the breaker's probe slot"""
+        breaker = genshin_app.getBreaker(user_id)
+        if breaker.state != breaker.CLOSED:
+            log.info(f'[schedule][System]schedule: {breaker.display_name} is down, pausing the run')
+        async with breaker.turn():
+            yield
+
+    def __remove_user(self, user_id: str, store: SubscriptionStore, *, commit: bool = True) -> None:
+        if store.remove(user_id, commit=commit) == False:
+            log.info(f'[exception][System]Schedule > __remove_user(user_id={user_id}): User does not exist')
 
 async def setup(client: commands.Bot):
     await client.add_cog(Schedule(client))
\ No newline at end of file
@@ -1,8 +1,15 @@
+import asyncio
+import aiohttp
 import discord
 from discord.ext import commands
 from pathlib import Path
 from utility.config import config
 from utility.utils import log
+from utility.writer import background_writer
+from utility.database import ResponseCache, getChangeFeed, getUserLastUseTime
+from utility.GenshinApp import genshin_app
+from utility.session import createSession
+from utility import Enka
 
 intents = discord.Intents.default()
 class GenshinDiscordBot(commands.Bot):
@@ -12,8 +19,19 @@ class GenshinDiscordBot(commands.Bot):
             intents=intents,
             application_id=config.application_id
         )
+        self.change_feed_task: asyncio.Task = None
+        self.last_use_task: asyncio.Task = None
+        self.http_session: aiohttp.ClientSession = None
 
     async def setup_hook(self) -> None:
+        # One keep-alive HTTP session for the whole bot lifetime, shared by Enka and Hoyolab requests
+        self.http_session = createSession()
+        Enka.setSession(self.http_session)
+        genshin_app.setSession(self.http_session)
+        # Keep the caches coherent with other bot processes sharing the database
+        self.change_feed_task = asyncio.create_task(getChangeFeed().run(config.change_poll_interval))
+        # Every process writes its users' last used times, not only the one running the schedule
+        self.last_use_task = asyncio.create_task(getUserLastUseTime().run(config.last_use_save_interval))
         # Load all cogs from the cogs folder
         for filepath in Path('./cogs').glob('**/*.py'):
             cog_name = Path(filepath).stem
@@ -24,6 +42,19 @@ class GenshinDiscordBot(commands.Bot):
             self.tree.copy_global_to(guild=test_guild)
             await self.tree.sync(guild=test_guild)
 
+    async def close(self) -> None:
+        for task in (self.change_feed_task, self.last_use_task):
+            if task != None:
+                task.cancel()
+        await super().close()
+        await genshin_app.close()
+        if self.http_session != None:
+            await self.http_session.close()
+        getUserLastUseTime().save()
+        # Flush all pending writes before the process exits
+        await asyncio.to_thread(background_writer.close)
+        ResponseCache.closeAll()
+
     async def on_ready(self):
         log.info(f'[News][System]on_ready: You have logged in as {self.user}')
         log.info(f'[News][System]on_ready: Total {len(self.guilds)} servers connected')
@@ -1,3 +1,7 @@
+import os
+import json
+import time
+import asyncio
 import aiohttp
 import discord
 from typing import Any, Dict, List, Union, Optional
@@ -6,11 +10,105 @@ from data.game.characters import characters_map
 from data.game.weapons import weapons_map
 from data.game.artifacts import artifcats_map
 from data.game.fight_prop import fight_prop_map, get_prop_name
+from utility.session import createSession
+from utility.config import config
+from utility.cache import TTLCache, SingleFlight
+from utility.writer import background_writer
+from utility.breaker import getBreaker
+
+__session: Optional[aiohttp.ClientSession] = None
+
+def setSession(session: aiohttp.ClientSession) -> None:
+    """Use the bot-lifetime shared session for all Enka requests"""
+    global __session
+    __session = session
+
+def getSession() -> aiohttp.ClientSession:
+    global __session
+    if __session == None or __session.closed:
+        __session = createSession()
+    return __session
 
 class ShowcaseNotPublic(Exception):
     def __init__(self, message: str) -> None:
-        super().__init
-        (message)
+        super().__init__(message)
+
+class ProfileNotFound(Exception):
+    pass
+
+class EnkaError(Exception):
+    """Enka answered with an unexpected HTTP status"""
+    def __init__(self, status: int) -> None:
+        super().__init__(f'Failed to get API data (HTTP {status})')
+        self.status = status
+
+# UID -> showcase data, or the `ProfileNotFound` raised for it
+__cache = TTLCache('enka_cache', config.enka_cache_size, config.enka_negative_cache_ttl)
+__flight = SingleFlight('enka_fetch')
+__breaker = getBreaker('enka', 'Enka.network')
+if config.enka_cache_dir != None:
+    os.makedirs(config.enka_cache_dir, exist_ok=True)
+
+async def fetchEnkaData(uid: int) -> Dict[str, Any]:
+    """Get the showcase data of the UID, cached for the `ttl` given by the API.
+    Concurrent lookups of the same UID share one request, missing profiles and hidden showcases are cached for a short time.
+    Raises `CircuitOpen` without asking Enka while it is known to be down"""
+    cached = __cache.get(uid)
+    if cached == None and config.enka_cache_dir != None:
+        cached = await asyncio.to_thread(__readDiskCache, uid)
+    if cached == None:
+        cached = await __flight.do(uid, lambda: __request(uid))
+    if isinstance(cached, ProfileNotFound):
+        raise cached
+    return cached
+
+async def __request(uid: int) -> Union[Dict[str, Any], ProfileNotFound]:
+    probe = __breaker.check()
+    try:
+        result = await __get(uid)
+    except asyncio.CancelledError:
+        if probe:
+            __breaker.release()
+        raise
+    except Exception as e:
+        # Client errors (bad UID, rate limited...) are answers, only server errors and network failures are an outage
+        if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)) or (isinstance(e, EnkaError) and e.status >= 500):
+            __breaker.failure()
+        else:
+            __breaker.success()
+        raise
+    __breaker.success()
+    return result
+
+async def __get(uid: int) -> Union[Dict[str, Any], ProfileNotFound]:
+    async with getSession().get(f'https://enka.shinshin.moe/u/{uid}/__data.json') as resp:
+        if resp.status == 200:
+            data: Dict[str, Any] = await resp.json()
+            ttl = data.get('ttl', config.enka_negative_cache_ttl)
+            if 'avatarInfoList' not in data:
+                ttl = min(ttl, config.enka_negative_cache_ttl)
+            __cache.set(uid, data, ttl)
+            if config.enka_cache_dir != None:
+                background_writer.writeJson(os.path.join(config.enka_cache_dir, f'{uid}.json'), {'expire': time.time() + ttl, 'data': data})
+            return data
+        elif resp.status == 500:
+            result = ProfileNotFound("This UID player profile does not exist")
+            __cache.set(uid, result)
+            return result
+        else:
+            raise EnkaError(resp.status)
+
+def __readDiskCache(uid: int) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(config.enka_cache_dir, f'{uid}.json'), 'r', encoding='utf-8') as f:
+            entry: Dict[str, Any] = json.load(f)
+    except (OSError, ValueError):
+        return None
+    ttl = entry['expire'] - time.time()
+    if ttl <= 0:
+        return None
+    __cache.set(uid, entry['data'], ttl)
+    return entry['data']
 
 class Showcase:
     data: Dict[str, Any] = None
@@ -24,15 +122,9 @@ class Showcase:
         """Get the character showcase data of the player with the specified UID from the API"""
         self.uid = uid
         self.url = f'https://enka.shinshin.moe/u/{uid}'
-        async with aiohttp.request('GET', self.url + '/__data.json') as resp:
-            if resp.status == 200:
-                self.data = await resp.json()
-                if 'avatarInfoList' not in self.data:
-                    raise ShowcaseNotPublic("The in-game character showcase is not enble for public")
-            elif resp.status == 500:
-                raise Exception("This UID player profile does not exist")
-            else:
-                raise Exception("Failed to get API data")
+        self.data = await fetchEnkaData(uid)
+        if 'avatarInfoList' not in self.data:
+            raise ShowcaseNotPublic("The in-game character showcase is not enble for public")
 
     def getPlayerOverviewEmbed(self) -> discord.Embed:
         """Embed message to get player's basic data"""
@@ -1,12 +1,23 @@
 import asyncio
 import json
+import time
+import aiohttp
 import discord
 import genshin
 from datetime import datetime, timedelta
-from typing import Sequence, Union, Tuple
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Union, Tuple
 from .emoji import Emoji, emoji
-from .utils import log, getCharacterName, trimCookie, getServerName, getDayOfWeek, user_last_use_time
+from .utils import log, getCharacterName, trimCookie, getServerName, getDayOfWeek
 from .config import config
+from .database import UserRecord, ResponseCache, openUserStore, getChangeFeed, getUserLastUseTime
+from .writer import background_writer
+from .cache import LRUCache, TTLCache, SingleFlight
+from .session import createSession
+from .notes import NotesSnapshot
+from .roster import CharacterSummary, parseRoster
+from .ratelimit import rate_limiter, RateLimiter
+from .retry import DeadlineExceeded, getRetryPolicy
+from .breaker import CircuitBreaker, getBreaker
 from discord.emoji import Emoji
 
 
@@ -16,13 +27,46 @@ def Conv_month(num):
     return month[num]
 
 
+class PooledCookieManager(genshin.client.manager.CookieManager):
+    """Cookie manager whose sessions borrow the shared connector, so connections and TLS sessions survive between requests"""
+    session: aiohttp.ClientSession = None
+
+    def create_session(self, **kwargs) -> aiohttp.ClientSession:
+        if PooledCookieManager.session == None or PooledCookieManager.session.closed:
+            PooledCookieManager.session = createSession()
+        shared = PooledCookieManager.session
+        return aiohttp.ClientSession(
+            cookie_jar=aiohttp.DummyCookieJar(),
+            connector=shared.connector,
+            connector_owner=False,
+            timeout=shared.timeout,
+            **kwargs)
+
+
 class GenshinApp:
     def __init__(self) -> None:
+        # Configured clients of recently active users, invalidated whenever the user data changes
+        self.__clients = LRUCache('client_pool', config.client_pool_size)
+        # Per-endpoint single-flight of identical concurrent reads
+        self.__flights: dict[str, SingleFlight] = {}
+        # uid -> last real-time notes fetched from Hoyolab
+        self.__notes = LRUCache('notes_snapshot', config.notes_snapshot_size)
+        # Completed Spiral Abyss seasons never change, the current one is kept for a short time
+        self.__abyss_cache = ResponseCache('abyss_cache', config.database_file, config.abyss_cache_size)
+        # Traveler's Diary by (uid, year, month), stored as the parsed numeric fields
+        self.__diary_cache = ResponseCache('diary_cache', config.database_file, config.diary_cache_size)
+        # Character roster by uid in the compact `CharacterSummary` form
+        self.__roster_cache = ResponseCache('roster_cache', config.database_file, config.roster_cache_size)
+        # Cookie fingerprint -> game accounts, so onboarding (setCookie then setUID) asks Hoyolab once
+        self.__game_accounts = TTLCache('game_accounts', config.game_accounts_cache_size, config.game_accounts_ttl)
+        self.__store = openUserStore(config.user_store, config.database_file)
         try:
-            with open('data/user_data.json', 'r', encoding="utf-8") as f:
-                self.__user_data: dict[str, dict[str, str]] = json.load(f)
-        except:
-            self.__user_data: dict[str, dict[str, str]] = {}
+            self.__user_data: dict[str, UserRecord] = self.__store.load()
+        except Exception as e:
+            log.error(f'[exception][System]GenshinApp > __init__: {e}')
+            self.__user_data: dict[str, UserRecord] = {}
+        getUserLastUseTime().addMissingUsers(self.__user_data.keys())
+        getChangeFeed().subscribe('users', self.__onUsersChanged)
 
     async def setCookie(self, user_id: str, cookie: str) -> str:
 
@@ -41,22 +85,34 @@ class GenshinApp:
         cookie = trimCookie(cookie)
         if cookie == None:
             return f'Invalid cookie, please re-enter (enter `/setup` to display instructions)'
-        client = genshin.Client(lang='en-us')
-        client.set_cookies(cookie)
+        record = UserRecord.fromCookie(cookie)
+
+        async def attempt() -> Sequence[genshin.models.GenshinAccount]:
+            client = genshin.Client(lang='en-us')
+            client.cookie_manager = PooledCookieManager(cookie)
+            await rate_limiter.acquire('game_accounts')
+            return await client.get_game_accounts()
         try:
-            accounts = await client.get_game_accounts()
+            accounts = await self.__fetchGameAccounts(record, lambda: getRetryPolicy('game_accounts').run(attempt))
         except genshin.errors.GenshinException as e:
             log.info(
                 f'[exception][{user_id}]setCookie: [retcode]{e.retcode} [Exceptions]{e.original}')
             result = e.original
+        except DeadlineExceeded as e:
+            log.info(f'[exception][{user_id}]setCookie: {e}')
+            result = str(e)
+        except Exception as e:
+            log.error(f'[exception][{user_id}]setCookie: {e}')
+            result = f'Failed to set cookie: {e}'
         else:
             if len(accounts) == 0:
                 log.info(
                     f'[News][{user_id}]setCookie: There are no roles in the account')
                 result = 'There is no role in the account, cancel the setting of cookies'
             else:
-                self.__user_data[user_id] = {}
-                self.__user_data[user_id]['cookie'] = cookie
+                self.__user_data[user_id] = record
+                self.__invalidateCaches(user_id)
+                getUserLastUseTime().update(user_id)
                 log.info(
                     f'[News][{user_id}]setCookie: Cookie set successfully')
 
@@ -68,7 +124,7 @@ class GenshinApp:
                     for account in accounts:
                         result += f'UID:{account.uid} AR:{account.level} Name:{account.nickname}\n'
                     result += f'```\nPlease use `/uid setting` to specify the character to save Genshin Impact (Example: `/uid setting 812345678`)'
-                    self.__saveUserData()
+                    self.__saveUserData(user_id)
         finally:
             return result
 
@@ -87,8 +143,9 @@ class GenshinApp:
         log.info(
             f'[instruction][{user_id}]setUID: uid={uid}, check_uid={check_uid}')
         if not check_uid:
-            self.__user_data[user_id]['uid'] = uid
-            self.__saveUserData()
+            self.__user_data[user_id].setUID(int(uid))
+            self.__invalidateCaches(user_id)
+            self.__saveUserData(user_id)
             return f'Character UID: {uid} has been set'
         check, msg = self.checkUserData(user_id, checkUID=False)
         if check == False:
@@ -96,17 +153,18 @@ class GenshinApp:
         if len(uid) != 9:
             return f'The UID length is wrong, please re-enter the correct UID of Genshin Impact'
 
-        # Check if UID exists
-        client = self.__getGenshinClient(user_id)
+        # Check if UID exists, usually answered from the accounts fetched by setCookie
         try:
-            accounts = await client.get_game_accounts()
+            accounts = await self.__fetchGameAccounts(self.__user_data[user_id],
+                lambda: self.__upstream(user_id, 'game_accounts', lambda client: client.get_game_accounts(), key=()))
         except Exception as e:
             log.error(f'[exception][{user_id}]setUID: {e}')
             return 'Failed to confirm account information, please reset cookies or try again later'
         else:
             if int(uid) in [account.uid for account in accounts]:
-                self.__user_data[user_id]['uid'] = uid
-                self.__saveUserData()
+                self.__user_data[user_id].setUID(int(uid))
+                self.__invalidateCaches(user_id)
+                self.__saveUserData(user_id)
                 log.info(f'[News][{user_id}]setUID: {uid} set up')
                 return f'Character UID: {uid} set up'
             else:
@@ -114,12 +172,35 @@ class GenshinApp:
                     f'[News][{user_id}]setUID: Could not find character profile for this UID')
                 return f'The character information for this UID cannot be found, please confirm whether the input is correct'
 
+    async def getGameAccounts(self, user_id: str) -> Union[str, Sequence[genshin.models.GenshinAccount]]:
+        """Get the game accounts bound to the user's cookie, shared with `setCookie` and `setUID` for `config.game_accounts_ttl` seconds
+
+        ------
+        Parameters
+        user_id `str`: User Discord ID
+        ------
+        Returns
+        `str | Sequence[GenshinAccount]`: error message `str` when an exception occurs, otherwise the accounts
+        """
+        check, msg = self.checkUserData(user_id, checkUID=False)
+        if check == False:
+            return msg
+        try:
+            return await self.__fetchGameAccounts(self.__user_data[user_id],
+                lambda: self.__upstream(user_id, 'game_accounts', lambda client: client.get_game_accounts(), key=()))
+        except genshin.errors.GenshinException as e:
+            log.info(f'[exception][{user_id}]getGameAccounts: [retcode]{e.retcode} [Exceptions]{e.original}')
+            return e.original
+        except Exception as e:
+            log.error(f'[exception][{user_id}]getGameAccounts: {e}')
+            return str(e)
+
     def getUID(self, user_id: str) -> Union[int, None]:
         if user_id in self.__user_data.keys():
-            return int(self.__user_data[user_id].get('uid'))
+            return self.__user_data[user_id].uid
         return None
 
-    async def getRealtimeNote(self, user_id: str, *, schedule=False) -> Union[None, str, discord.Embed]:
+    async def getRealtimeNote(self, user_id: str, *, schedule=False, force_refresh=False) -> Union[None, str, discord.Embed]:
         """Obtain user instant notes (resin, Dongtianbao money, parameter quality changer, dispatch, daily, weekly)
 
         ------
@@ -127,6 +208,7 @@ class GenshinApp:
         user_id `str`: User Discord ID
         schedule `bool`: Whether to check resin for scheduling, when set to `True`, the instant note result will 
         only be returned when the resin exceeds the set standard
+        force_refresh `bool`: Always ask Hoyolab, instead of extrapolating a snapshot younger than `config.notes_fresh_window`
         ------
         Returns
         `None | str | Embed`: When the resin is automatically checked, `None` is returned 
@@ -140,10 +222,13 @@ class GenshinApp:
         if check == False:
             return msg
 
-        uid = self.__user_data[user_id]['uid']
-        client = self.__getGenshinClient(user_id)
+        uid = self.__user_data[user_id].uid
         try:
-            notes = await client.get_genshin_notes(int(uid))
+            snapshot: NotesSnapshot = self.__notes.get(uid)
+            if force_refresh or snapshot == None or snapshot.age() > config.notes_fresh_window:
+                snapshot = NotesSnapshot(await self.__upstream(user_id, 'notes', lambda client: client.get_genshin_notes(uid), key=(uid,), background=schedule))
+                self.__notes.set(uid, snapshot)
+            notes = snapshot.extrapolate()
         except genshin.errors.DataNotPublic:
             log.info(f'[exception][{user_id}]getRealtimeNote: DataNotPublic')
             return 'The instant note function is not enabled, please enable the instant note function from the Hoyolab website or app first'
@@ -159,9 +244,11 @@ class GenshinApp:
             log.error(f'[exception][{user_id}]getRealtimeNote: {e}')
             return str(e)
         else:
-            if schedule == True and notes.current_resin < config.auto_check_resin_threshold:
+            # A threshold above the cap means full resin, or the reminder could never be sent
+            if schedule == True and notes.current_resin < min(config.auto_check_resin_threshold, notes.max_resin):
                 return None
             else:
+                uid = str(uid)
                 msg = f'{getServerName(uid[0])} {uid.replace(uid[3:-3], "&&&", 1)}\n'
                 msg += f'~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~~-~-~-~-~\n'
                 msg += self.__parseNotes(notes, shortForm=schedule)
@@ -188,10 +275,9 @@ class GenshinApp:
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
-
+        uid = self.__user_data[user_id].uid
         try:
-            await client.redeem_code(code, int(self.__user_data[user_id]['uid']), lang="en-us")
+            await self.__upstream(user_id, 'redeem_code', lambda client: client.redeem_code(code, uid, lang="en-us"))
         except genshin.errors.GenshinException as e:
             log.info(
                 f'[exception][{user_id}]redeemCode: [retcode]{e.retcode} [Exceptions]{e.original}')
@@ -204,7 +290,7 @@ class GenshinApp:
         finally:
             return result
 
-    async def claimDailyReward(self, user_id: str, *, honkai: bool = False, schedule=False) -> str:
+    async def claimDailyReward(self, user_id: str, *, honkai: bool = False, schedule=False, claimed: Optional[Dict[genshin.Game, str]] = None) -> str:
         """Sign in for users at Hoyolab
 
         ------
@@ -212,6 +298,8 @@ class GenshinApp:
         user_id `str`: User Discord ID
         honkai `bool`: whether to also sign in Honkai 3
         schedule `bool`: whether to check in automatically for the schedule
+        claimed `dict[Game, str]`: result text of the games known to be claimed today, they are skipped and their text is reused;
+        the games claimed (or found already claimed) by this call are added to it
         ------
         Returns
         `str`:Reply to user's message
@@ -223,22 +311,19 @@ class GenshinApp:
             user_id, update_use_time=(not schedule))
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
-
         game_name = {genshin.Game.GENSHIN: 'Genshin',
                      genshin.Game.HONKAI: 'Honaki 3'}
 
-        async def claimReward(game: genshin.Game, retry: int = 3) -> str:
+        async def claimReward(game: genshin.Game) -> str:
+            if claimed != None and game in claimed:
+                return claimed[game]
             try:
-                reward = await client.claim_daily_reward(game=game)
+                reward = await self.__upstream(user_id, 'claim_daily_reward', lambda client: client.claim_daily_reward(game=game), background=schedule)
             except genshin.errors.AlreadyClaimed:
-                return f"{game_name[game]}'s reward has been received!"
+                message = f"{game_name[game]}'s reward has been received!"
             except genshin.errors.GenshinException as e:
                 log.info(
                     f'[exception][{user_id}]claimDailyReward: {game_name[game]}[retcode]{e.retcode} [Exceptions]{e.original}')
-                if e.retcode == 0 and retry > 0:
-                    await asyncio.sleep(0.5)
-                    return await claimReward(game, retry - 1)
                 if e.retcode == -10002 and game == genshin.Game.HONKAI:
                     return 'Honkai 3 failed to sign in, no character information was found, please confirm whether the captain has bound the new HoYoverse pass'
                 return f'{game_name[game]}Failed to sign in: [retcode]{e.retcode} [content]{e.original}'
@@ -247,7 +332,10 @@ class GenshinApp:
                     f'[exception][{user_id}]claimDailyReward: {game_name[game]}[Exceptions]{e}')
                 return f'{game_name[game]}Failed to sign in: {e}'
             else:
-                return f'{game_name[game]} Sign in done successfully, got {reward.amount} x {reward.name}！'
+                message = f'{game_name[game]} Sign in done successfully, got {reward.amount} x {reward.name}！'
+            if claimed != None:
+                claimed[game] = message
+            return message
 
         result = await claimReward(genshin.Game.GENSHIN)
         if honkai:
@@ -255,7 +343,7 @@ class GenshinApp:
 
         # Hoyolab community check-in
         try:
-            await client.check_in_community()
+            await self.__upstream(user_id, 'check_in_community', lambda client: client.check_in_community(), background=schedule)
         except genshin.errors.GenshinException as e:
             log.info(
                 f'[exception][{user_id}]claimDailyReward: Hoyolab[retcode]{e.retcode} [Exceptions]{e.original}')
@@ -281,9 +369,12 @@ class GenshinApp:
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
+        uid = self.__user_data[user_id].uid
+        if (abyss := await self.__getCachedAbyss(uid, previous)) != None:
+            return abyss
         try:
-            abyss = await client.get_genshin_spiral_abyss(int(self.__user_data[user_id]['uid']), previous=previous)
+            abyss = await self.__upstream(user_id, 'spiral_abyss',
+                lambda client: client.get_genshin_spiral_abyss(uid, previous=previous), key=(uid, previous))
         except genshin.errors.GenshinException as e:
             log.error(
                 f'[exception][{user_id}]getSpiralAbyss: [retcode]{e.retcode} [Exceptions]{e.original}')
@@ -292,6 +383,7 @@ class GenshinApp:
             log.error(f'[exception][{user_id}]getSpiralAbyss: [Exceptions]{e}')
             return f'{e}'
         else:
+            self.__cacheAbyss(user_id, uid, abyss, previous)
             return abyss
 
     async def getTravelerDiary(self, user_id: str, month: int) -> Union[str, discord.Embed]:
@@ -309,9 +401,14 @@ class GenshinApp:
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
+        uid = self.__user_data[user_id].uid
+        now = datetime.now()
+        year = now.year if month <= now.month else now.year - 1
+        key = f'{uid}:{year}-{month:02d}'
+        if (value := await self.__diary_cache.get(key)) != None:
+            return self.parseDiary(json.loads(value))
         try:
-            diary = await client.get_diary(int(self.__user_data[user_id]['uid']), month=month)
+            diary = await self.__upstream(user_id, 'diary', lambda client: client.get_diary(uid, month=month), key=(uid, month))
         except genshin.errors.GenshinException as e:
             log.error(
                 f'[exception][{user_id}]getTravelerDiary: [retcode]{e.retcode} [exception]{e.original}')
@@ -322,25 +419,22 @@ class GenshinApp:
             result = f'{e}'
         else:
             d = diary.data
-            result = discord.Embed(
-                title=f"{diary.nickname}'s Notes for {Conv_month(month)}",
-                description=f'Primogems income compared to last month {"increased" if d.primogems_rate > 0 else "reduced"} to {abs(d.primogems_rate)}%, Mora income compared to last month {"increased" if d.mora_rate > 0 else "reduced"} to {abs(d.mora_rate)}%',
-                color=0xfd96f4
-            )
-            result.add_field(
-                name='Obtained this month',
-                value=f'{emoji.items.primogem}This month {d.current_primogems} ({round(d.current_primogems/160)}{emoji.items.intertwined_fate}) || Last month {d.last_primogems} ({round(d.last_primogems/160)}{emoji.items.intertwined_fate})\n'
-                f'{emoji.items.mora}This month {format(d.current_mora, ",")} ||  Last month {format(d.last_mora, ",")}',
-                inline=False
-            )
-            # Divide the note rough composition into two fields
-            for i in range(0, 2):
-                msg = ''
-                length = len(d.categories)
-                for j in range(round(length/2*i), round(length/2*(i+1))):
-                    msg += f'{d.categories[j].name[0:15]}: {d.categories[j].percentage}%\n'
-                result.add_field(
-                    name=f'Primogems Income Composition ({i+1})', value=msg, inline=True)
+            fields = {
+                'nickname': diary.nickname,
+                'month': month,
+                'current_primogems': d.current_primogems,
+                'current_mora': d.current_mora,
+                'last_primogems': d.last_primogems,
+                'last_mora': d.last_mora,
+                'primogems_rate': d.primogems_rate,
+                'mora_rate': d.mora_rate,
+                'categories': [[c.name, c.percentage, c.amount] for c in d.categories]
+            }
+            # The totals of a month are final once it is over, allow a day for the servers in other time zones
+            month_end = datetime(year + month // 12, month % 12 + 1, 1)
+            ttl = None if now >= month_end + timedelta(days=1) else config.diary_current_ttl
+            self.__diary_cache.set(key, json.dumps(fields), user_id, ttl=ttl)
+            result = self.parseDiary(fields)
         finally:
             return result
 
@@ -358,10 +452,11 @@ class GenshinApp:
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
+        uid = self.__user_data[user_id].uid
         try:
-            cards = await client.get_record_cards()
-            userstats = await client.get_partial_genshin_user(int(self.__user_data[user_id]['uid']))
+            cards, userstats = await asyncio.gather(
+                self.__upstream(user_id, 'record_cards', lambda client: client.get_record_cards(), key=()),
+                self.__upstream(user_id, 'partial_user', lambda client: client.get_partial_genshin_user(uid), key=(uid,)))
         except genshin.errors.GenshinException as e:
             log.error(
                 f'[exception][{user_id}]getRecordCard: [retcode]{e.retcode} [exception]{e.original}')
@@ -371,27 +466,30 @@ class GenshinApp:
             return str(e)
         else:
             for card in cards:
-                if card.uid == int(self.__user_data[user_id]['uid']):
+                if card.uid == uid:
                     return (card, userstats)
             return "Can't find Genshin record card"
 
-    async def getCharacters(self, user_id: str) -> Union[str, Sequence[genshin.models.Character]]:
+    async def getCharacters(self, user_id: str, *, force_refresh=False) -> Union[str, Sequence[CharacterSummary]]:
         """Get all user role data
 
          ------
          Parameters:
          user_id `str`: User Discord ID
+         force_refresh `bool`: Ask Hoyolab even when the roster cached within `config.roster_cache_ttl` seconds is available
          ------
          Returns:
-         `str | Sequence[Character]`: When an exception occurs, the error message `str` is returned, and the query result `Sequence[Character]` is returned under normal conditions.
+         `str | Sequence[CharacterSummary]`: When an exception occurs, the error message `str` is returned, and the query result `Sequence[CharacterSummary]` is returned under normal conditions.
         """
-        log.info(f'[instruction][{user_id}]getCharacters')
+        log.info(f'[instruction][{user_id}]getCharacters: force_refresh={force_refresh}')
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
+        uid = self.__user_data[user_id].uid
+        if not force_refresh and (value := await self.__roster_cache.get(str(uid))) != None:
+            return parseRoster(json.loads(value))
         try:
-            characters = await client.get_genshin_characters(int(self.__user_data[user_id]['uid']))
+            characters = await self.__upstream(user_id, 'characters', lambda client: client.get_genshin_characters(uid), key=(uid,))
         except genshin.errors.GenshinException as e:
             log.error(
                 f'[exception][{user_id}]getCharacters: [retcode]{e.retcode} [exception]{e.original}')
@@ -400,7 +498,26 @@ class GenshinApp:
             log.error(f'[exception][{user_id}]getCharacters: [exception]{e}')
             return str(e)
         else:
-            return characters
+            roster = [CharacterSummary.fromCharacter(character) for character in characters]
+            self.__roster_cache.set(str(uid), json.dumps([character.toList() for character in roster]), user_id, ttl=config.roster_cache_ttl)
+            return roster
+
+    def getResinReachTime(self, user_id: str, resin: int) -> Optional[float]:
+        """Earliest unix time at which the original resin of the user reaches `resin` by natural recovery,
+        predicted from the last notes snapshot of the user's uid, `None` when there is no snapshot"""
+        record = self.__user_data.get(user_id)
+        snapshot: NotesSnapshot = None if record == None else self.__notes.get(record.uid)
+        if snapshot == None:
+            return None
+        return snapshot.resinReachTime(resin)
+
+    def getBreaker(self, user_id: str) -> CircuitBreaker:
+        """The circuit breaker of the Hoyolab server (region) of the user's UID, the schedule waits on it during outages"""
+        record = self.__user_data.get(user_id)
+        server = str(record.uid)[0] if record != None and record.uid != None else None
+        if server == None:
+            return getBreaker('hoyolab', 'Hoyolab')
+        return getBreaker(f'hoyolab.{server}', f'Hoyolab ({getServerName(server)} server)')
 
     def checkUserData(self, user_id: str, *, checkUID=True, update_use_time=True) -> Tuple[bool, str]:
         """Check if user-related data has been saved in the database
@@ -419,15 +536,12 @@ class GenshinApp:
             log.info(f'[News][{user_id}]checkUserData: User not found')
             return False, f'Cannot find the user, please set a cookie first (enter `/setup` to display the description)'
         else:
-            if 'cookie' not in self.__user_data[user_id].keys():
-                log.info(f'[News][{user_id}]checkUserData: Cookie not foundv')
-                return False, f"Can't find cookie, please set cookie first (enter `/setup` to display instructions)"
-            if checkUID and 'uid' not in self.__user_data[user_id].keys():
+            if checkUID and self.__user_data[user_id].uid == None:
                 log.info(
                     f'[News][{user_id}]checkUserData: Character UID not found')
                 return False, f'Cannot find character UID, please set UID first (use `/uid setting` to set UID)'
         if update_use_time:
-            user_last_use_time.update(user_id)
+            getUserLastUseTime().update(user_id)
         return True, None
 
     def clearUserData(self, user_id: str) -> str:
@@ -443,24 +557,35 @@ class GenshinApp:
         log.info(f'[instruction][{user_id}]clearUserData')
         try:
             del self.__user_data[user_id]
-            user_last_use_time.deleteUser(user_id)
+            getUserLastUseTime().deleteUser(user_id)
         except:
             return 'Deletion failed, user data not found'
         else:
-            self.__saveUserData()
+            self.__invalidateCaches(user_id)
+            self.__saveUserData(user_id)
             return 'User data has all been deleted'
 
-    def deleteExpiredUserData(self) -> None:
-        """Delete users that have not been used for more than 30 days"""
-        now = datetime.now()
-        count = 0
-        user_data = dict(self.__user_data)
-        for user_id in user_data.keys():
-            if user_last_use_time.checkExpiry(user_id, now, 30) == True:
-                self.clearUserData(user_id)
-                count += 1
+    async def deleteExpiredUserData(self) -> None:
+        """Delete users that have not been used for more than 30 days, the expiry index only yields the
+        users past the cutoff and they are deleted from the store in one batch"""
+        start = time.perf_counter()
+        expired, examined = await getUserLastUseTime().popExpired(datetime.now(), 30)
+        expired = [user_id for user_id in expired if self.__user_data.pop(user_id, None) != None]
+        for user_id in expired:
+            self.__clients.pop(user_id)
+        if len(expired) > 0:
+            background_writer.submit(('expired', start), lambda: self.__store.deleteMany(expired))
         log.info(
-            f'[News][System]deleteExpiredUserData: {len(user_data)} users checked, deleted {count} expired users')
+            f'[News][System]deleteExpiredUserData: {examined} users examined, deleted {len(expired)} expired users in {time.perf_counter() - start:.3f}s')
+
+    def setSession(self, session: aiohttp.ClientSession) -> None:
+        """Use the connection pool of the bot-lifetime shared session for all Hoyolab requests"""
+        PooledCookieManager.session = session
+        self.__clients.clear()
+
+    async def close(self) -> None:
+        """Drop the pooled clients, the shared session is closed by its owner"""
+        self.__clients.clear()
 
     def parseAbyssOverview(self, abyss: genshin.models.SpiralAbyss) -> discord.Embed:
         """Analyze the abyss overview data, including date, number of layers, number of battles, total number of stars...etc.
@@ -513,12 +638,45 @@ class GenshinApp:
                 embed.add_field(name=name, value=value)
         return embed
 
-    def parseCharacter(self, character: genshin.models.Character) -> discord.Embed:
+    def parseDiary(self, diary: dict) -> discord.Embed:
+        """Build the Traveler's Diary embed from the fields cached by `getTravelerDiary`
+
+        ------
+        Parameters
+        diary `dict`: nickname, month, current/last primogems and mora, primogems/mora rate and categories `[name, percentage, amount]`
+        ------
+        Returns
+        `discord.Embed`: the diary embed
+        """
+        d = diary
+        result = discord.Embed(
+            title=f"{d['nickname']}'s Notes for {Conv_month(d['month'])}",
+            description=f'Primogems income compared to last month {"increased" if d["primogems_rate"] > 0 else "reduced"} to {abs(d["primogems_rate"])}%, Mora income compared to last month {"increased" if d["mora_rate"] > 0 else "reduced"} to {abs(d["mora_rate"])}%',
+            color=0xfd96f4
+        )
+        result.add_field(
+            name='Obtained this month',
+            value=f'{emoji.items.primogem}This month {d["current_primogems"]} ({round(d["current_primogems"]/160)}{emoji.items.intertwined_fate}) || Last month {d["last_primogems"]} ({round(d["last_primogems"]/160)}{emoji.items.intertwined_fate})\n'
+            f'{emoji.items.mora}This month {format(d["current_mora"], ",")} ||  Last month {format(d["last_mora"], ",")}',
+            inline=False
+        )
+        # Divide the note rough composition into two fields
+        categories = d['categories']
+        for i in range(0, 2):
+            msg = ''
+            length = len(categories)
+            for j in range(round(length/2*i), round(length/2*(i+1))):
+                msg += f'{categories[j][0][0:15]}: {categories[j][1]}%\n'
+            result.add_field(
+                name=f'Primogems Income Composition ({i+1})', value=msg, inline=True)
+        return result
+
+    def parseCharacter(self, character: CharacterSummary) -> discord.Embed:
         """Analyze characters, including zodiac, level, favor, weapons, Artifacts
 
          ------
          Parameters
-         character `Character`: character profile
+         character `CharacterSummary`: character profile
          ------
          Returns
          `discord.Embed`: discord embed format
@@ -530,20 +688,20 @@ class GenshinApp:
         embed.add_field(name=f'★{character.rarity} {character.name}', inline=True,
                         value=f'Constellation: {character.constellation}\n Character lvl: {character.level}\n Friendship lvl: {character.friendship}')
 
-        weapon = character.weapon
-        embed.add_field(name=f'★{weapon.rarity} {weapon.name}', inline=True,
-                        value=f'refinement lvl: {weapon.refinement}\n Weapon lvl: {weapon.level}')
+        weapon_name, weapon_rarity, refinement, weapon_level = character.weapon
+        embed.add_field(name=f'★{weapon_rarity} {weapon_name}', inline=True,
+                        value=f'refinement lvl: {refinement}\n Weapon lvl: {weapon_level}')
 
         if character.constellation > 0:
             number = {1: 'First', 2: 'Second', 3: 'Third',
                       4: 'Fourth', 5: 'Fifth', 6: 'Sixth'}
             msg = '\n'.join(
-                [f'Constellation: {number[constella.pos]} <> Name: {constella.name}' for constella in character.constellations if constella.activated])
+                [f'Constellation: {number[pos]} <> Name: {name}' for pos, name in character.constellations])
             embed.add_field(name='Constellation', inline=False, value=msg)
 
         if len(character.artifacts) > 0:
             msg = '\n'.join(
-                [f'{artifact.pos_name}: {artifact.name} ({artifact.set.name})' for artifact in character.artifacts])
+                [f'{pos_name}: {name} ({set_name})' for pos_name, name, set_name in character.artifacts])
             embed.add_field(name='Artifacts', inline=False, value=msg)
 
         return embed
@@ -607,24 +765,144 @@ class GenshinApp:
 
         return result
 
-    def __saveUserData(self) -> None:
+    async def __getCachedAbyss(self, uid: int, previous: bool) -> Optional[genshin.models.SpiralAbyss]:
+        key = f'{uid}:current'
+        if previous:
+            # Points to the season that was the previous one when it was fetched
+            if (season := await self.__abyss_cache.get(f'{uid}:previous')) == None:
+                return None
+            key = f'{uid}:{season}'
+        if (value := await self.__abyss_cache.get(key)) == None:
+            return None
         try:
-            with open('data/user_data.json', 'w', encoding='utf-8') as f:
-                json.dump(self.__user_data, f)
-        except:
-            log.error(
-                '[exception][System]GenshinApp > __saveUserData: Archive failed')
+            return genshin.models.SpiralAbyss.parse_raw(value)
+        except Exception as e:
+            log.error(f'[exception][System]GenshinApp > __getCachedAbyss(uid={uid}): {e}')
+            return None
+
+    def __cacheAbyss(self, user_id: str, uid: int, abyss: genshin.models.SpiralAbyss, previous: bool) -> None:
+        """Completed seasons are kept by (uid, season) until evicted, the current one for `config.abyss_current_ttl` seconds"""
+        now = datetime.now().astimezone()
+        value = abyss.json(by_alias=True)
+        if previous:
+            if abyss.end_time > now:
+                return
+            self.__abyss_cache.set(f'{uid}:{abyss.season}', value, user_id)
+            # A season lasts at least 13 days, until then the current one cannot have ended and this stays the previous one
+            ttl = (abyss.end_time + timedelta(days=13) - now).total_seconds()
+            if ttl > 0:
+                self.__abyss_cache.set(f'{uid}:previous', str(abyss.season), user_id, ttl=ttl)
+        else:
+            ttl = min(config.abyss_current_ttl, (abyss.end_time - now).total_seconds())
+            if ttl > 0:
+                self.__abyss_cache.set(f'{uid}:current', value, user_id, ttl=ttl)
+
+    async def __fetchGameAccounts(self, record: UserRecord, fetch: Callable[[], Awaitable[Sequence[genshin.models.GenshinAccount]]]) -> Sequence[genshin.models.GenshinAccount]:
+        """The game accounts of the cookie, fetched with `fetch` only when not cached for its fingerprint"""
+        if (accounts := self.__game_accounts.get(record.fingerprint)) != None:
+            return accounts
+        accounts = list(await fetch())
+        self.__game_accounts.set(record.fingerprint, accounts)
+        return accounts
+
+    def __invalidateCaches(self, user_id: str) -> None:
+        """Drop the cached Hoyolab data of the user, called when the cookie or UID changes"""
+        self.__abyss_cache.invalidate(user_id)
+        self.__diary_cache.invalidate(user_id)
+        self.__roster_cache.invalidate(user_id)
+
+    def __saveUserData(self, user_id: str) -> None:
+        """Persist a single user in the background: upsert when the user exists in memory, otherwise delete it from the store"""
+        self.__clients.pop(user_id)
+        if user_id in self.__user_data:
+            record = self.__user_data[user_id].copy()
+            background_writer.submit(('user', user_id), lambda: self.__store.upsert(user_id, record))
+        else:
+            background_writer.submit(('user', user_id), lambda: self.__store.delete(user_id))
+
+    async def __onUsersChanged(self, user_ids: list[str]) -> None:
+        """Reload the users changed by another bot process"""
+        data = await asyncio.to_thread(self.__store.loadMany, user_ids)
+        for user_id in user_ids:
+            self.__clients.pop(user_id)
+            if user_id in data:
+                self.__user_data[user_id] = data[user_id]
+            else:
+                self.__user_data.pop(user_id, None)
+
+    async def __upstream(self, user_id: str, endpoint: str, call: Callable[[genshin.Client], Awaitable[Any]], *, key: Optional[tuple] = None, background: bool = False) -> Any:
+        """Every Hoyolab request of a user goes through here
+
+        ------
+        Parameters
+        user_id `str`: User Discord ID
+        endpoint `str`: name of the request, used for metrics and rate limits
+        call `(Client) -> Awaitable`: makes the request with the user's client
+        key `tuple`: for read-only requests, concurrent calls with the same user, endpoint and key share one request,
+        every caller still gets (and handles) the result or the exception itself
+        background `bool`: requests of the schedule wait behind the interactive ones for the rate limits,
+        and may retry for longer (`config.retry_background_deadline`)
+        """
+        client = self.__getGenshinClient(user_id)
+        account = self.__user_data[user_id].ltuid
+        priority = RateLimiter.BACKGROUND if background else RateLimiter.INTERACTIVE
+        retry_policy = getRetryPolicy(endpoint)
+        breaker = self.getBreaker(user_id)
+
+        # Whether the last attempt got to call Hoyolab, a deadline hit while waiting for the local rate limits is no outage
+        calling = False
+
+        async def attempt() -> Any:
+            nonlocal calling
+            calling = False
+            await rate_limiter.acquire(endpoint, account, priority)
+            calling = True
+            return await call(client)
+
+        async def request() -> Any:
+            probe = breaker.check()
+            try:
+                result = await retry_policy.run(attempt, background=background)
+            except asyncio.CancelledError:
+                # A cancelled probe must not keep its slot, or the breaker would stay half-open for good
+                if probe:
+                    breaker.release()
+                raise
+            except DeadlineExceeded:
+                if calling:
+                    breaker.failure()
+                elif probe:
+                    breaker.release()
+                raise
+            except Exception as e:
+                # Hoyolab answering with an error (invalid cookie, private data...) is not an outage
+                if not isinstance(e, genshin.errors.GenshinException) or isinstance(e, genshin.errors.InternalDatabaseError):
+                    breaker.failure()
+                else:
+                    breaker.success()
+                raise
+            breaker.success()
+            return result
+
+        if key == None:
+            return await request()
+        if (flight := self.__flights.get(endpoint)) == None:
+            flight = self.__flights[endpoint] = SingleFlight(f'genshin.{endpoint}')
+        # Interactive and background callers have different deadlines and priorities, they never share a request
+        return await flight.do((user_id, background, *key), request)
 
     def __getGenshinClient(self, user_id: str) -> genshin.Client:
-        uid = self.__user_data[user_id].get('uid')
-        if uid != None and uid[0] in ['1', '2', '5']:
-            client = genshin.Client(
-                region=genshin.Region.OVERSEAS, lang='en-us')
+        client: genshin.Client = self.__clients.get(user_id)
+        if client != None:
+            return client
+        record = self.__user_data[user_id]
+        if record.region != None:
+            client = genshin.Client(region=record.region, lang='en-us')
         else:
             client = genshin.Client(lang='en-us')
-        client.set_cookies(self.__user_data[user_id]['cookie'])
+        client.cookie_manager = PooledCookieManager(record.cookies)
         client.default_game = genshin.Game.GENSHIN
+        self.__clients.set(user_id, client)
         return client
 
-
 genshin_app = GenshinApp()
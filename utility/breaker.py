@@ -0,0 +1,132 @@
+import time
+import asyncio
+import contextlib
+import contextvars
+from typing import Dict, Optional
+from .config import config
+from .metrics import metrics
+from .utils import log
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose breaker is open"""
+    def __init__(self, display_name: str, retry_after: float) -> None:
+        super().__init__(f'{display_name} is not responding right now, please try again in {max(1, round(retry_after))} seconds')
+        self.retry_after = retry_after
+
+class ProbeTurn:
+    """A probe slot handed out by `CircuitBreaker.turn()`, the first call of the block uses it"""
+    __slots__ = ('breaker', 'used')
+
+    def __init__(self, breaker: 'CircuitBreaker') -> None:
+        self.breaker = breaker
+        self.used = False
+
+# The probe slot held by the current task (and the tasks it starts)
+_probe_turn: contextvars.ContextVar[Optional[ProbeTurn]] = contextvars.ContextVar('probe_turn', default=None)
+
+class CircuitBreaker:
+    """Stops calling an upstream after `failure_threshold` consecutive failures.
+
+    While open every call fails fast with `CircuitOpen`. After `reset_timeout` seconds the breaker is half-open
+    and lets `half_open_max` probe calls through: a successful probe closes it, a failed one opens it again.
+    The state is reported as the gauge `breaker.{name}.open` and the transitions are counted as `breaker.{name}.opened`
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name: str, display_name: str) -> None:
+        self.name = name
+        self.display_name = display_name
+        self.failure_threshold = config.breaker_failure_threshold
+        self.reset_timeout = config.breaker_reset_timeout
+        self.half_open_max = config.breaker_half_open_max
+        self.state = self.CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__probes = 0
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the open breaker lets a probe through"""
+        return max(0.0, self.__opened_at + self.reset_timeout - time.monotonic())
+
+    def allowRequest(self) -> bool:
+        """Whether a call may go through now, a call that is let through must end with `success()` or `failure()`"""
+        if self.state == self.OPEN:
+            if self.retry_after > 0:
+                return False
+            self.state = self.HALF_OPEN
+            self.__probes = 0
+            log.info(f'[News][System]CircuitBreaker > {self.name}: half-open, probing')
+        if self.state == self.HALF_OPEN:
+            if self.__probes >= self.half_open_max:
+                return False
+            self.__probes += 1
+        return True
+
+    def check(self) -> bool:
+        """`allowRequest()` that raises `CircuitOpen` when the call is not allowed.
+        Returns whether the call is a probe, a probe that ends without `success()` or `failure()` (cancelled) must call `release()`"""
+        turn = _probe_turn.get()
+        if turn != None and turn.breaker is self and not turn.used:
+            turn.used = True
+            return True
+        if not self.allowRequest():
+            metrics.increment(f'breaker.{self.name}.rejected')
+            raise CircuitOpen(self.display_name, self.retry_after if self.state == self.OPEN else self.reset_timeout)
+        return self.state == self.HALF_OPEN
+
+    def release(self) -> None:
+        """Give back the probe slot of a call that ended without an outcome"""
+        if self.state == self.HALF_OPEN and self.__probes > 0:
+            self.__probes -= 1
+
+    def success(self) -> None:
+        if self.state != self.CLOSED:
+            log.info(f'[News][System]CircuitBreaker > {self.name}: closed')
+            metrics.setGauge(f'breaker.{self.name}.open', 0)
+        self.state = self.CLOSED
+        self.__failures = 0
+
+    def failure(self) -> None:
+        self.__failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.__failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.__opened_at = time.monotonic()
+            metrics.increment(f'breaker.{self.name}.opened')
+            metrics.setGauge(f'breaker.{self.name}.open', 1)
+            log.error(f'[exception][System]CircuitBreaker > {self.name}: open after {self.__failures} consecutive failures')
+
+    @contextlib.asynccontextmanager
+    async def turn(self):
+        """Wait until calls are let through, for background work that should pause during an outage instead of failing.
+
+        While the breaker is open the waiters sleep, once it is half-open they are let in one probe slot at a time:
+        the first call inside the `async with` block uses the held slot, the others keep waiting until the probe
+        closes the breaker. The slot is given back when the block ends without using it
+        """
+        turn = None
+        while self.state != self.CLOSED:
+            if self.state == self.OPEN and self.retry_after > 0:
+                await asyncio.sleep(self.retry_after)
+            elif self.allowRequest():
+                turn = ProbeTurn(self)
+                break
+            else:
+                await asyncio.sleep(1)
+        token = _probe_turn.set(turn)
+        try:
+            yield
+        finally:
+            _probe_turn.reset(token)
+            if turn != None and not turn.used:
+                self.release()
+
+__breakers: Dict[str, CircuitBreaker] = { }
+
+def getBreaker(name: str, display_name: str) -> CircuitBreaker:
+    """The breaker of an upstream (e.g. `hoyolab.8` for the Asia server, `enka`), created on first use"""
+    if (breaker := __breakers.get(name)) == None:
+        breaker = __breakers[name] = CircuitBreaker(name, display_name)
+    return breaker
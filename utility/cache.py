@@ -0,0 +1,108 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from .metrics import metrics
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry, hits and misses are counted as `{name}.hit` / `{name}.miss`"""
+    def __init__(self, name: str, maxsize: int) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.__data: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self.__data.get(key)
+        if value == None:
+            metrics.increment(f'{self.name}.miss')
+            return None
+        self.__data.move_to_end(key)
+        metrics.increment(f'{self.name}.hit')
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.__data[key] = value
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)
+            metrics.increment(f'{self.name}.evict')
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        return self.__data.pop(key, None)
+
+    def clear(self) -> None:
+        self.__data.clear()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__data
+
+class TTLCache:
+    """Bounded mapping whose entries expire after their own time-to-live (seconds), hits and misses are counted like `LRUCache`"""
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expire time, value)
+        self.__data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.__data.get(key)
+        if entry == None or entry[0] <= time.monotonic():
+            if entry != None:
+                del self.__data[key]
+            metrics.increment(f'{self.name}.miss')
+            return None
+        self.__data.move_to_end(key)
+        metrics.increment(f'{self.name}.hit')
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self.__data[key] = (time.monotonic() + (self.ttl if ttl == None else ttl), value)
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)
+            metrics.increment(f'{self.name}.evict')
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """The value without counting a hit or miss or refreshing its position"""
+        entry = self.__data.get(key)
+        return None if entry == None or entry[0] <= time.monotonic() else entry[1]
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        entry = self.__data.pop(key, None)
+        return None if entry == None else entry[1]
+
+    def clear(self) -> None:
+        self.__data.clear()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self.__data.get(key)
+        return entry != None and entry[0] > time.monotonic()
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight call, every caller gets the result (or the exception) of it.
+    Callers that started the call are counted as `{name}.leader`, callers that joined it as `{name}.shared`,
+    `{name}.dedup_ratio` is the share of calls that joined another one"""
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.__calls: Dict[Hashable, asyncio.Task] = { }
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        metrics.increment(f'{self.name}.calls')
+        task = self.__calls.get(key)
+        if task == None:
+            metrics.increment(f'{self.name}.leader')
+            task = asyncio.ensure_future(call())
+            self.__calls[key] = task
+            task.add_done_callback(lambda _: self.__calls.pop(key, None))
+        else:
+            metrics.increment(f'{self.name}.shared')
+        metrics.setGauge(f'{self.name}.dedup_ratio', round(metrics.ratio(f'{self.name}.shared', f'{self.name}.calls'), 3))
+        # A cancelled caller must not cancel the call shared by the others
+        return await asyncio.shield(task)
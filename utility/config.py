@@ -1,13 +1,103 @@
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
 
+class RetryPolicyConfig(BaseModel):
+    attempts: int = 3
+    # Backoff doubles from base_delay up to max_delay seconds, with full jitter
+    base_delay: float = 0.5
+    max_delay: float = 4.0
+    # Seconds an interactive call may take in total, commands that do not defer must answer Discord within 3 seconds
+    deadline: float = 10.0
+    retcodes: List[int] = [-1, -110, -500004]
+    # Also retry connection errors and timeouts
+    network_errors: bool = True
+
 class Config(BaseModel):
     application_id: int
     test_server_id: int
     bot_token: str
     auto_daily_reward_time: int = 8
     auto_check_resin_threshold: int = 145
-    auto_loop_delay: float = 2.0
+    # Users checked in at the same time by the daily run, and the seconds the Hoyolab requests of one user may take
+    # (waits for a server outage are not counted); it covers the Genshin, Honkai 3 and Hoyolab community check-ins retrying for retry_background_deadline each
+    auto_daily_reward_concurrency: int = 20
+    auto_daily_reward_timeout: float = 200.0
+    # Attempts of a check-in that failed or timed out, and the seconds between them
+    auto_daily_reward_attempts: int = 3
+    auto_daily_reward_retry_delay: float = 300.0
+    # The daily check-in of each user is spread over this many seconds after auto_daily_reward_time
+    auto_daily_reward_window: float = 3600.0
+    auto_check_resin_concurrency: int = 10
+    # Seconds the notes request of one resin check may take, it covers retrying for retry_background_deadline
+    auto_check_resin_timeout: float = 75.0
+    # Longest time between two resin checks of a subscriber, even when the resin is predicted to stay below the threshold
+    resin_recheck_interval: float = 7200.0
+    # Scheduled messages to a channel within this many seconds are batched, then sent at most at the channel and global rates
+    outbox_flush_delay: float = 2.0
+    outbox_channel_rate: float = 1.0
+    outbox_channel_burst: int = 5
+    outbox_global_rate: float = 40.0
+    outbox_send_attempts: int = 3
+    # Display names of users that are not pinged, kept in memory and in the database, and the Discord REST lookups per second
+    display_name_cache_size: int = 10000
+    display_name_ttl: float = 86400.0
+    display_name_fetch_rate: float = 5.0
     slash_cmd_cooldown: float = 5.0
+    user_store: str = 'sqlite'
+    database_file: str = 'data/genshin.db'
+    # Multiple bot processes sharing the database need distinct names, only one of them should run the schedule
+    process_name: str = 'main'
+    run_schedule: bool = True
+    change_poll_interval: float = 2.0
+    # Seconds between two saves of the last used times, done by every process
+    last_use_save_interval: float = 600.0
+    client_pool_size: int = 1000
+    # /notes within this many seconds of the last Hoyolab fetch are extrapolated from it
+    notes_fresh_window: float = 300.0
+    notes_snapshot_size: int = 10000
+    abyss_cache_size: int = 20000
+    abyss_current_ttl: float = 600.0
+    diary_cache_size: int = 20000
+    diary_current_ttl: float = 600.0
+    roster_cache_size: int = 20000
+    roster_cache_ttl: float = 3600.0
+    game_accounts_cache_size: int = 1000
+    game_accounts_ttl: float = 300.0
+    # Hoyolab request budgets (requests per second, burst), the schedule runs as fast as they allow
+    ratelimit_global_rate: float = 10.0
+    ratelimit_global_burst: int = 20
+    ratelimit_endpoints: Dict[str, Tuple[float, int]] = {'claim_daily_reward': (5.0, 10), 'redeem_code': (2.0, 5)}
+    ratelimit_account_rate: float = 1.0
+    ratelimit_account_burst: int = 5
+    # Seconds an account has to wait between two calls of these endpoints
+    ratelimit_account_cooldowns: Dict[str, float] = {'redeem_code': 5.0}
+    ratelimit_max_accounts: int = 10000
+    # Retry policy by endpoint name, endpoints not listed use 'default'
+    retry_policies: Dict[str, RetryPolicyConfig] = {
+        'default': RetryPolicyConfig(),
+        'notes': RetryPolicyConfig(deadline=2.5),
+        'diary': RetryPolicyConfig(deadline=2.5),
+        'game_accounts': RetryPolicyConfig(deadline=2.5),
+        'claim_daily_reward': RetryPolicyConfig(retcodes=[0, -1, -110, -500004]),
+        # Redeeming is not idempotent: a lost response may hide a redemption that went through, only rejected requests are retried
+        'redeem_code': RetryPolicyConfig(retcodes=[-110, -500004], network_errors=False)
+    }
+    # Total time a scheduled call may spend retrying
+    retry_background_deadline: float = 60.0
+    # Consecutive failures that open the circuit breaker of an upstream, seconds until it is probed again
+    breaker_failure_threshold: int = 5
+    breaker_reset_timeout: float = 60.0
+    breaker_half_open_max: int = 1
+    http_timeout: float = 15.0
+    http_connect_timeout: float = 5.0
+    http_connection_limit: int = 100
+    http_connection_limit_per_host: int = 20
+    http_dns_cache_ttl: int = 300
+    http_keepalive_timeout: float = 60.0
+    enka_cache_size: int = 1000
+    enka_negative_cache_ttl: float = 60.0
+    # Set a folder (e.g. data/enka_cache) to keep the showcase cache on disk across restarts
+    enka_cache_dir: Optional[str] = None
 
 config = Config.parse_file(Path('config.json'), encoding='utf8')
\ No newline at end of file
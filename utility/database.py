@@ -0,0 +1,863 @@
+import os
+import re
+import json
+import time
+import heapq
+import hashlib
+import struct
+import asyncio
+import sqlite3
+import threading
+import contextlib
+import genshin
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from .utils import log
+from .config import config
+from .writer import background_writer, writeFileAtomic
+from .metrics import metrics
+
+# Identifies the changes made by this process in the `changes` table
+PROCESS_ORIGIN = f'{config.process_name}:{os.getpid()}'
+
+def connectSQLite(filename: str) -> sqlite3.Connection:
+    """Open a connection in WAL mode that can be used from the background writer thread (guard it with a lock).
+    Several bot processes may share the database file, writers wait on each other's locks for up to `busy_timeout`"""
+    conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS changes ('
+        'seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT, key TEXT, origin TEXT, created INTEGER)')
+    return conn
+
+def recordChanges(conn: sqlite3.Connection, table: str, keys: Iterable[str]) -> None:
+    """Append the changed keys to the `changes` table, call it inside the writing transaction"""
+    now = int(time.time())
+    conn.executemany(
+        'INSERT INTO changes (tbl, key, origin, created) VALUES (?, ?, ?, ?)',
+        [(table, key, PROCESS_ORIGIN, now) for key in keys])
+
+class UserRecord:
+    """A registered user: the cookie fields are parsed once and the UID is kept as an int"""
+    __slots__ = ('ltuid', 'ltoken', 'cookie_token', 'account_id', 'uid', 'region')
+    __cookie_patterns = {
+        'ltoken': re.compile('ltoken=([0-9A-Za-z]{20,})'),
+        'ltuid': re.compile('ltuid=([0-9]{3,})'),
+        'cookie_token': re.compile('cookie_token=([0-9A-Za-z]{20,})'),
+        'account_id': re.compile('account_id=([0-9]{3,})')
+    }
+
+    def __init__(self, ltuid: int, ltoken: str, cookie_token: str, account_id: int, uid: Optional[int] = None) -> None:
+        self.ltuid = ltuid
+        self.ltoken = ltoken
+        self.cookie_token = cookie_token
+        self.account_id = account_id
+        self.setUID(uid)
+
+    @classmethod
+    def fromCookie(cls, cookie: str, uid: Optional[int] = None) -> 'UserRecord':
+        """Parse a cookie string trimmed by `trimCookie`, raises `ValueError` when a field is missing"""
+        fields = { }
+        for name, pattern in cls.__cookie_patterns.items():
+            if (match := pattern.search(cookie)) == None:
+                raise ValueError(f'{name} not found in cookie')
+            fields[name] = match.group(1)
+        return cls(int(fields['ltuid']), fields['ltoken'], fields['cookie_token'], int(fields['account_id']), uid)
+
+    @classmethod
+    def fromDict(cls, data: Dict[str, str]) -> 'UserRecord':
+        """Build from the legacy `{'cookie': ..., 'uid': ...}` format"""
+        uid = data.get('uid')
+        return cls.fromCookie(data['cookie'], int(uid) if uid != None else None)
+
+    def setUID(self, uid: Optional[int]) -> None:
+        self.uid = uid
+        # Sky Island and World Tree servers
+        self.region = genshin.Region.OVERSEAS if uid != None and str(uid)[0] in ['1', '2', '5'] else None
+
+    @property
+    def cookie(self) -> str:
+        return f'ltoken={self.ltoken} ltuid={self.ltuid} cookie_token={self.cookie_token} account_id={self.account_id}'
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the cookie without exposing it, e.g. as a cache key"""
+        return hashlib.sha256(self.cookie.encode('utf-8')).hexdigest()
+
+    @property
+    def cookies(self) -> Dict[str, str]:
+        """Cookie mapping for `genshin.Client.set_cookies`"""
+        return {'ltoken': self.ltoken, 'ltuid': str(self.ltuid), 'cookie_token': self.cookie_token, 'account_id': str(self.account_id)}
+
+    def toDict(self) -> Dict[str, str]:
+        data = {'cookie': self.cookie}
+        if self.uid != None:
+            data['uid'] = str(self.uid)
+        return data
+
+    def copy(self) -> 'UserRecord':
+        return UserRecord(self.ltuid, self.ltoken, self.cookie_token, self.account_id, self.uid)
+
+class UserStore:
+    """Storage backend of the user data (cookie, uid), every write only touches the changed user.
+    Writes are called from the background writer thread"""
+    def load(self) -> Dict[str, UserRecord]:
+        """Read the data of all users"""
+        raise NotImplementedError
+
+    def loadMany(self, user_ids: Iterable[str]) -> Dict[str, UserRecord]:
+        """Read the data of the given users, missing users are left out"""
+        user_ids = set(user_ids)
+        return {user_id: record for user_id, record in self.load().items() if user_id in user_ids}
+
+    def upsert(self, user_id: str, record: UserRecord) -> None:
+        """Insert or update the data of a single user"""
+        raise NotImplementedError
+
+    def delete(self, user_id: str) -> None:
+        """Delete the data of a single user"""
+        raise NotImplementedError
+
+    def deleteMany(self, user_ids: Iterable[str]) -> None:
+        """Delete several users at once"""
+        for user_id in user_ids:
+            self.delete(user_id)
+
+    def close(self) -> None:
+        pass
+
+class JsonUserStore(UserStore):
+    """Legacy backend, the whole file is rewritten on every change"""
+    def __init__(self, filename: str = 'data/user_data.json') -> None:
+        self.filename = filename
+        self.__data: Dict[str, Dict[str, str]] = { }
+
+    def load(self) -> Dict[str, UserRecord]:
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                self.__data = json.load(f)
+        except:
+            self.__data = { }
+        return parseUserRecords(self.__data.items())
+
+    def upsert(self, user_id: str, record: UserRecord) -> None:
+        self.__data[user_id] = record.toDict()
+        self.__save()
+
+    def delete(self, user_id: str) -> None:
+        if self.__data.pop(user_id, None) != None:
+            self.__save()
+
+    def deleteMany(self, user_ids: Iterable[str]) -> None:
+        count = len(self.__data)
+        for user_id in user_ids:
+            self.__data.pop(user_id, None)
+        if len(self.__data) != count:
+            self.__save()
+
+    def __save(self) -> None:
+        try:
+            writeFileAtomic(self.filename, json.dumps(self.__data).encode('utf-8'))
+        except:
+            log.error('[exception][System]JsonUserStore > __save: Archive failed')
+
+class SQLiteUserStore(UserStore):
+    """Default backend, an embedded SQLite database in WAL mode with per-row upserts and deletes"""
+    def __init__(self, filename: str = 'data/genshin.db') -> None:
+        self.filename = filename
+        self.__lock = threading.Lock()
+        self.__conn = connectSQLite(filename)
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS users ('
+            'user_id TEXT PRIMARY KEY, cookie TEXT, uid TEXT)')
+
+    def load(self) -> Dict[str, UserRecord]:
+        with self.__lock:
+            rows = self.__conn.execute('SELECT user_id, cookie, uid FROM users').fetchall()
+        return self.__parseRows(rows)
+
+    def loadMany(self, user_ids: Iterable[str]) -> Dict[str, UserRecord]:
+        user_ids = list(user_ids)
+        rows = []
+        with self.__lock:
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i+500]
+                rows += self.__conn.execute(
+                    f'SELECT user_id, cookie, uid FROM users WHERE user_id IN ({",".join("?" * len(chunk))})', chunk).fetchall()
+        return self.__parseRows(rows)
+
+    def count(self) -> int:
+        with self.__lock:
+            return self.__conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def upsert(self, user_id: str, record: UserRecord) -> None:
+        self.upsertMany([(user_id, record)])
+
+    def upsertMany(self, items: Iterable[Tuple[str, UserRecord]]) -> None:
+        """Insert or update several users in one transaction, `items` is an iterable of `(user_id, record)`"""
+        rows = [(user_id, record.cookie, str(record.uid) if record.uid != None else None) for user_id, record in items]
+        with self.__lock:
+            with self.__conn:
+                self.__conn.execute('BEGIN IMMEDIATE')
+                self.__conn.executemany(
+                    'INSERT INTO users (user_id, cookie, uid) VALUES (?, ?, ?) '
+                    'ON CONFLICT(user_id) DO UPDATE SET cookie=excluded.cookie, uid=excluded.uid', rows)
+                recordChanges(self.__conn, 'users', [row[0] for row in rows])
+
+    def delete(self, user_id: str) -> None:
+        self.deleteMany([user_id])
+
+    def deleteMany(self, user_ids: Iterable[str]) -> None:
+        rows = [(user_id,) for user_id in user_ids]
+        with self.__lock:
+            with self.__conn:
+                self.__conn.execute('BEGIN IMMEDIATE')
+                self.__conn.executemany('DELETE FROM users WHERE user_id = ?', rows)
+                recordChanges(self.__conn, 'users', [row[0] for row in rows])
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__conn.close()
+
+    def __parseRows(self, rows: List[tuple]) -> Dict[str, UserRecord]:
+        return parseUserRecords((user_id, {'cookie': cookie, 'uid': uid}) for user_id, cookie, uid in rows if cookie != None)
+
+def parseUserRecords(items: Iterable[Tuple[str, Dict[str, str]]]) -> Dict[str, UserRecord]:
+    """Parse `(user_id, {'cookie': ..., 'uid': ...})` items, users with a broken cookie are logged and skipped"""
+    result: Dict[str, UserRecord] = { }
+    for user_id, data in items:
+        if data.get('uid') == None:
+            data = {'cookie': data['cookie']}
+        try:
+            result[user_id] = UserRecord.fromDict(data)
+        except (KeyError, ValueError) as e:
+            log.error(f'[exception][System]parseUserRecords(user_id={user_id}): {e}')
+    return result
+
+class SubscriptionStore:
+    """Schedule subscriptions of one kind (`daily` check-in or `resin` reminder), stored one row per user.
+
+    `data` keeps the legacy shape `{user_id: {'channel': ..., 'mention': 'False', 'honkai': 'True'}}`.
+    Changes made inside `batch()` (or removals with `commit=False`) are collected in memory and committed in one transaction
+    when the batch ends (or at the next `commit()`), other changes are committed right away. Changes committed by other processes are picked up from the change feed
+    """
+    def __init__(self, kind: str, filename: str, legacy_filename: Optional[str] = None) -> None:
+        self.kind = kind
+        self.__lock = threading.Lock()
+        self.__conn_lock = threading.Lock()
+        self.__conn = connectSQLite(filename)
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS schedule_subscriptions ('
+            'kind TEXT, user_id TEXT, channel TEXT, mention INTEGER, honkai INTEGER, PRIMARY KEY (kind, user_id))')
+        # user_id -> row to upsert, or None to delete, waiting to be committed
+        self.__changes: Dict[str, Optional[Tuple]] = { }
+        self.__batch_depth = 0
+        self.data: Dict[str, Dict[str, str]] = self.__load()
+        if legacy_filename != None and len(self.data) == 0:
+            self.__migrateJson(legacy_filename)
+        getChangeFeed().subscribe(f'subscriptions.{kind}', self.__onChanged)
+
+    def close(self) -> None:
+        """Stop following the change feed, pending changes are still committed"""
+        getChangeFeed().unsubscribe(f'subscriptions.{self.kind}', self.__onChanged)
+        self.commit()
+
+    def add(self, user_id: str, channel: str, *, mention: bool = True) -> None:
+        self.data[user_id] = { }
+        self.data[user_id]['channel'] = channel
+        if mention == False:
+            self.data[user_id]['mention'] = 'False'
+        self.__changed(user_id)
+
+    def addHonkai(self, user_id: str) -> None:
+        """Join Honkai 3 to sign in to an existing user"""
+        if self.data.get(user_id) != None:
+            self.data[user_id]['honkai'] = 'True'
+            self.__changed(user_id)
+
+    def remove(self, user_id: str, *, commit: bool = True) -> bool:
+        """Remove the user, returns `False` when the user does not exist.
+        With `commit=False` the removal waits for the next `commit()`, e.g. the removals of a schedule run are committed once at its end"""
+        if self.data.pop(user_id, None) == None:
+            return False
+        self.__changed(user_id, commit)
+        return True
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Collect every change made inside the `with` block and commit them once at the end.
+        The batch covers the whole store, do not hold it across awaits"""
+        self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+            if self.__batch_depth == 0:
+                self.commit()
+
+    def commit(self) -> None:
+        """Write all pending changes in the background, in one transaction"""
+        if len(self.__changes) > 0:
+            background_writer.submit(('subscriptions', self.kind), self.__writeChanges)
+
+    def __changed(self, user_id: str, commit: bool = True) -> None:
+        data = self.data.get(user_id)
+        row = None if data == None else (
+            self.kind, user_id, data['channel'], int(data.get('mention') != 'False'), int(data.get('honkai') == 'True'))
+        with self.__lock:
+            self.__changes[user_id] = row
+        if commit and self.__batch_depth == 0:
+            self.commit()
+
+    def __writeChanges(self) -> None:
+        # Only the pending changes are guarded by the lock, the connection is used by the writer thread alone
+        with self.__lock:
+            changes, self.__changes = self.__changes, { }
+        upserts = [row for row in changes.values() if row != None]
+        deletes = [(self.kind, user_id) for user_id, row in changes.items() if row == None]
+        with self.__conn_lock, self.__conn:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            self.__conn.executemany(
+                'INSERT INTO schedule_subscriptions (kind, user_id, channel, mention, honkai) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(kind, user_id) DO UPDATE SET channel=excluded.channel, mention=excluded.mention, honkai=excluded.honkai', upserts)
+            self.__conn.executemany('DELETE FROM schedule_subscriptions WHERE kind = ? AND user_id = ?', deletes)
+            recordChanges(self.__conn, f'subscriptions.{self.kind}', changes.keys())
+
+    async def __onChanged(self, user_ids: List[str]) -> None:
+        data = await asyncio.to_thread(self.__load, user_ids)
+        for user_id in user_ids:
+            if user_id in data:
+                self.data[user_id] = data[user_id]
+            else:
+                self.data.pop(user_id, None)
+
+    def __load(self, user_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, str]]:
+        with self.__conn_lock:
+            if user_ids == None:
+                rows = self.__conn.execute(
+                    'SELECT user_id, channel, mention, honkai FROM schedule_subscriptions WHERE kind = ?', (self.kind,)).fetchall()
+            else:
+                rows = []
+                for i in range(0, len(user_ids), 500):
+                    chunk = user_ids[i:i+500]
+                    rows += self.__conn.execute(
+                        'SELECT user_id, channel, mention, honkai FROM schedule_subscriptions '
+                        f'WHERE kind = ? AND user_id IN ({",".join("?" * len(chunk))})', [self.kind, *chunk]).fetchall()
+        data: Dict[str, Dict[str, str]] = { }
+        for user_id, channel, mention, honkai in rows:
+            data[user_id] = {'channel': channel}
+            if not mention:
+                data[user_id]['mention'] = 'False'
+            if honkai:
+                data[user_id]['honkai'] = 'True'
+        return data
+
+    def __migrateJson(self, legacy_filename: str) -> None:
+        """One-shot import of the legacy whole-dict JSON file, renamed to `*.migrated` afterwards"""
+        if not os.path.exists(legacy_filename):
+            return
+        try:
+            with open(legacy_filename, 'r', encoding='utf-8') as f:
+                legacy: Dict[str, Dict[str, str]] = json.load(f)
+            with self.batch():
+                for user_id, value in legacy.items():
+                    self.data[user_id] = dict(value)
+                    self.__changed(user_id)
+            background_writer.submit(('migrated', legacy_filename), lambda: os.replace(legacy_filename, legacy_filename + '.migrated'))
+        except Exception as e:
+            log.error(f'[exception][System]SubscriptionStore > __migrateJson({legacy_filename}): {e}')
+            return
+        log.info(f'[News][System]SubscriptionStore > __migrateJson: {len(legacy)} {self.kind} subscriptions migrated from {legacy_filename}')
+
+class ResponseCache:
+    """Persistent cache of Hoyolab responses (serialized as text) in the `response_cache` table, shared by all bot processes.
+
+    Entries of one `name` are capped at `maxsize`, the oldest written ones are dropped first.
+    Every entry belongs to a user (`owner`) so all of a user's entries can be invalidated at once, e.g. when the cookie or UID changes.
+    Reads use their own connection and never wait for the background writes
+    """
+    # Every cache opened, for `closeAll()` on shutdown
+    __instances: List['ResponseCache'] = []
+
+    def __init__(self, name: str, filename: str, maxsize: int) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.__conn_lock = threading.Lock()
+        self.__conn = connectSQLite(filename)
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'name TEXT, key TEXT, owner TEXT, value TEXT, expires REAL, updated REAL, PRIMARY KEY (name, key))')
+        self.__conn.execute('CREATE INDEX IF NOT EXISTS response_cache_owner ON response_cache (owner)')
+        self.__conn.execute('CREATE INDEX IF NOT EXISTS response_cache_updated ON response_cache (name, updated)')
+        self.__read_lock = threading.Lock()
+        self.__read_conn = connectSQLite(filename)
+        ResponseCache.__instances.append(self)
+
+    async def get(self, key: str) -> Optional[str]:
+        """The cached value, `None` when missing or expired. Read in a worker thread, off the event loop"""
+        row = await asyncio.to_thread(self.__read, key)
+        if row == None or (row[1] != None and row[1] <= time.time()):
+            metrics.increment(f'{self.name}.miss')
+            return None
+        metrics.increment(f'{self.name}.hit')
+        return row[0]
+
+    def set(self, key: str, value: str, owner: str, ttl: Optional[float] = None) -> None:
+        """Store `value` in the background, `ttl` (seconds) of `None` keeps it until evicted or invalidated"""
+        now = time.time()
+        row = (self.name, key, owner, value, None if ttl == None else now + ttl, now)
+        background_writer.submit(('response_cache', self.name, key), lambda: self.__write(row))
+
+    def replace(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """Update the value of an existing entry in the background, a missing key is not added"""
+        now = time.time()
+        row = (value, None if ttl == None else now + ttl, now, self.name, key)
+        background_writer.submit(('response_cache', self.name, 'replace', key), lambda: self.__update(row))
+
+    def invalidate(self, owner: str) -> None:
+        """Drop every entry of the user in the background"""
+        background_writer.submit(('response_cache', self.name, 'owner', owner), lambda: self.__delete(owner))
+
+    def close(self) -> None:
+        with self.__conn_lock:
+            self.__conn.close()
+        with self.__read_lock:
+            self.__read_conn.close()
+
+    @classmethod
+    def closeAll(cls) -> None:
+        """Close every cache, call it once the background writer is flushed since pending writes use the connections"""
+        for cache in cls.__instances:
+            cache.close()
+        cls.__instances.clear()
+
+    def __read(self, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        with self.__read_lock:
+            return self.__read_conn.execute(
+                'SELECT value, expires FROM response_cache WHERE name = ? AND key = ?', (self.name, key)).fetchone()
+
+    def __write(self, row: tuple) -> None:
+        with self.__conn_lock, self.__conn:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            self.__conn.execute(
+                'INSERT INTO response_cache (name, key, owner, value, expires, updated) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(name, key) DO UPDATE SET owner=excluded.owner, value=excluded.value, '
+                'expires=excluded.expires, updated=excluded.updated', row)
+            self.__conn.execute('DELETE FROM response_cache WHERE name = ? AND expires <= ?', (self.name, time.time()))
+            evicted = self.__conn.execute(
+                'DELETE FROM response_cache WHERE name = ? AND key IN ('
+                'SELECT key FROM response_cache WHERE name = ? ORDER BY updated DESC LIMIT -1 OFFSET ?)',
+                (self.name, self.name, self.maxsize)).rowcount
+        if evicted > 0:
+            metrics.increment(f'{self.name}.evict', evicted)
+
+    def __update(self, row: tuple) -> None:
+        with self.__conn_lock, self.__conn:
+            self.__conn.execute('UPDATE response_cache SET value = ?, expires = ?, updated = ? WHERE name = ? AND key = ?', row)
+
+    def __delete(self, owner: str) -> None:
+        with self.__conn_lock, self.__conn:
+            self.__conn.execute('DELETE FROM response_cache WHERE name = ? AND owner = ?', (self.name, owner))
+
+class ChangeFeed:
+    """Change notification between bot processes sharing the database.
+
+    Every write appends `(table, key)` to the `changes` table in the same transaction,
+    `run()` polls for rows written by other processes and calls the subscribed callbacks with the changed keys,
+    so the in-memory caches of each process stay coherent
+    """
+    def __init__(self, filename: str) -> None:
+        self.__conn = connectSQLite(filename)
+        self.__lock = threading.Lock()
+        self.__listeners: Dict[str, List[Callable[[List[str]], Awaitable[None]]]] = { }
+        self.__last_seq: int = self.__conn.execute('SELECT IFNULL(MAX(seq), 0) FROM changes').fetchone()[0]
+        self.__data_version: int = self.__conn.execute('PRAGMA data_version').fetchone()[0]
+        self.__last_prune = 0.0
+
+    def subscribe(self, table: str, callback: Callable[[List[str]], Awaitable[None]]) -> None:
+        self.__listeners.setdefault(table, []).append(callback)
+
+    def unsubscribe(self, table: str, callback: Callable[[List[str]], Awaitable[None]]) -> None:
+        if callback in self.__listeners.get(table, []):
+            self.__listeners[table].remove(callback)
+
+    async def run(self, interval: float) -> None:
+        """Poll for changes of other processes every `interval` seconds until cancelled"""
+        while True:
+            try:
+                changes = await asyncio.to_thread(self.poll)
+                for table, keys in changes.items():
+                    for callback in list(self.__listeners.get(table, [])):
+                        await callback(keys)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'[exception][System]ChangeFeed > run: {e}')
+            await asyncio.sleep(interval)
+
+    def poll(self) -> Dict[str, List[str]]:
+        """Read the changes of other processes since the last poll, grouped by table"""
+        with self.__lock:
+            # data_version only changes when another connection commits, so an idle poll costs no query
+            data_version = self.__conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self.__data_version:
+                return { }
+            self.__data_version = data_version
+            rows = self.__conn.execute(
+                'SELECT seq, tbl, key, origin FROM changes WHERE seq > ? ORDER BY seq', (self.__last_seq,)).fetchall()
+            if len(rows) > 0:
+                self.__last_seq = rows[-1][0]
+            if time.time() - self.__last_prune > 3600:
+                self.__last_prune = time.time()
+                self.__conn.execute('DELETE FROM changes WHERE created < ?', (int(time.time()) - 86400,))
+        changes: Dict[str, Dict[str, None]] = { }
+        for seq, table, key, origin in rows:
+            if origin != PROCESS_ORIGIN:
+                changes.setdefault(table, { })[key] = None
+        return {table: list(keys) for table, keys in changes.items()}
+
+__change_feed: Optional[ChangeFeed] = None
+
+def getChangeFeed() -> ChangeFeed:
+    """The change feed of `config.database_file`, opened on first use instead of at import"""
+    global __change_feed
+    if __change_feed == None:
+        __change_feed = ChangeFeed(config.database_file)
+    return __change_feed
+
+def migrateJsonUserData(store: SQLiteUserStore, json_filename: str = 'data/user_data.json') -> int:
+    """One-shot migration of the legacy JSON user file into the SQLite store.
+    The JSON file is renamed to `*.migrated` afterwards so the migration only runs once,
+    it is left in place when some users could not be parsed
+
+    ------
+    Parameters
+    store `SQLiteUserStore`: the destination store
+    json_filename `str`: the legacy user data file
+    ------
+    Returns
+    `int`: number of migrated users
+    """
+    if not os.path.exists(json_filename):
+        return 0
+    if store.count() > 0:
+        log.info(f'[News][System]migrateJsonUserData: {store.filename} already has data, skip migrating {json_filename}')
+        return 0
+    try:
+        with open(json_filename, 'r', encoding='utf-8') as f:
+            legacy: Dict[str, Dict[str, str]] = json.load(f)
+        user_data = parseUserRecords(legacy.items())
+        store.upsertMany(user_data.items())
+        # Keep the legacy file when users were skipped, so their data is not lost
+        if len(user_data) != len(legacy):
+            log.error(f'[exception][System]migrateJsonUserData: {len(legacy) - len(user_data)} users could not be parsed, {json_filename} is kept')
+        else:
+            os.replace(json_filename, json_filename + '.migrated')
+    except Exception as e:
+        log.error(f'[exception][System]migrateJsonUserData: {e}')
+        return 0
+    log.info(f'[News][System]migrateJsonUserData: {len(user_data)} users migrated from {json_filename}')
+    return len(user_data)
+
+def openUserStore(backend: str, filename: str) -> UserStore:
+    """Create the user store from the config, `backend` is `sqlite` or `json`"""
+    if backend == 'json':
+        return JsonUserStore()
+    store = SQLiteUserStore(filename)
+    migrateJsonUserData(store)
+    return store
+
+class JobQueue:
+    """Persisted scheduled work: one job per `(kind, user_id, run_date)` with a due time (unix seconds).
+
+    The jobs of a run are materialized once per `run_date` (also after a restart that missed the run window),
+    a job stays in the table until `complete()` so a run interrupted halfway resumes with the jobs left.
+    `retry()` postpones a job that timed out or failed and counts its attempts
+    """
+    def __init__(self, filename: str) -> None:
+        self.__lock = threading.Lock()
+        self.__conn = connectSQLite(filename)
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'kind TEXT, user_id TEXT, run_date TEXT, due REAL, attempts INTEGER DEFAULT 0, PRIMARY KEY (kind, user_id, run_date))')
+        if 'attempts' not in [row[1] for row in self.__conn.execute('PRAGMA table_info(jobs)').fetchall()]:
+            self.__conn.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0')
+        self.__conn.execute('CREATE INDEX IF NOT EXISTS jobs_due ON jobs (kind, due)')
+        self.__conn.execute('CREATE TABLE IF NOT EXISTS job_runs (kind TEXT, run_date TEXT, created REAL, PRIMARY KEY (kind, run_date))')
+
+    def materialize(self, kind: str, run_date: str, jobs: Iterable[Tuple[str, float]]) -> bool:
+        """Insert the `(user_id, due)` jobs of the run in one transaction, jobs of older runs are dropped.
+        Returns `False` when the run was already materialized (e.g. by another process)"""
+        rows = [(kind, user_id, run_date, due) for user_id, due in jobs]
+        with self.__lock, self.__conn:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            if self.__conn.execute('SELECT 1 FROM job_runs WHERE kind = ? AND run_date = ?', (kind, run_date)).fetchone() != None:
+                return False
+            self.__conn.execute('INSERT INTO job_runs (kind, run_date, created) VALUES (?, ?, ?)', (kind, run_date, time.time()))
+            self.__conn.execute('DELETE FROM jobs WHERE kind = ? AND run_date < ?', (kind, run_date))
+            self.__conn.execute('DELETE FROM job_runs WHERE kind = ? AND run_date < ?', (kind, run_date))
+            self.__conn.executemany('INSERT OR IGNORE INTO jobs (kind, user_id, run_date, due) VALUES (?, ?, ?, ?)', rows)
+        return True
+
+    def due(self, kind: str, now: float, limit: int = 1000) -> List[Tuple[str, str, int]]:
+        """`(user_id, run_date, attempts)` of the jobs whose due time has come, earliest first"""
+        with self.__lock:
+            return self.__conn.execute(
+                'SELECT user_id, run_date, attempts FROM jobs WHERE kind = ? AND due <= ? ORDER BY due LIMIT ?', (kind, now, limit)).fetchall()
+
+    def pending(self, kind: str) -> int:
+        with self.__lock:
+            return self.__conn.execute('SELECT COUNT(*) FROM jobs WHERE kind = ?', (kind,)).fetchone()[0]
+
+    def complete(self, kind: str, user_id: str, run_date: str) -> None:
+        """Remove the finished job in the background"""
+        background_writer.submit(('job', kind, user_id, run_date), lambda: self.__delete(kind, user_id, run_date))
+
+    def retry(self, kind: str, user_id: str, run_date: str, delay: float) -> None:
+        """Run the job again after `delay` seconds with one more attempt counted, in the background"""
+        background_writer.submit(('job', kind, user_id, run_date), lambda: self.__postpone(kind, user_id, run_date, time.time() + delay))
+
+    def __postpone(self, kind: str, user_id: str, run_date: str, due: float) -> None:
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                'UPDATE jobs SET due = ?, attempts = attempts + 1 WHERE kind = ? AND user_id = ? AND run_date = ?', (due, kind, user_id, run_date))
+
+    def __delete(self, kind: str, user_id: str, run_date: str) -> None:
+        with self.__lock, self.__conn:
+            self.__conn.execute('DELETE FROM jobs WHERE kind = ? AND user_id = ? AND run_date = ?', (kind, user_id, run_date))
+
+class ClaimLedger:
+    """Idempotency ledger of the daily rewards claimed by the schedule, one row per `(user_id, date, game)`
+    with the result text of the claim. The row of game `REPORTED` marks that the results were posted.
+    A resumed run skips what the ledger already has, so no reward is claimed (or reported) twice"""
+    REPORTED = 'reported'
+
+    def __init__(self, filename: str) -> None:
+        self.__lock = threading.Lock()
+        self.__conn = connectSQLite(filename)
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS claim_ledger ('
+            'user_id TEXT, date TEXT, game TEXT, created REAL, message TEXT, PRIMARY KEY (user_id, date, game))')
+        # Ledgers written before the result text was recorded
+        if 'message' not in [row[1] for row in self.__conn.execute('PRAGMA table_info(claim_ledger)').fetchall()]:
+            self.__conn.execute('ALTER TABLE claim_ledger ADD COLUMN message TEXT')
+
+    def load(self, date: str) -> Dict[str, Dict[str, Optional[str]]]:
+        """`{user_id: {game: result text}}` claimed on `date`"""
+        with self.__lock:
+            rows = self.__conn.execute('SELECT user_id, game, message FROM claim_ledger WHERE date = ?', (date,)).fetchall()
+        result: Dict[str, Dict[str, Optional[str]]] = { }
+        for user_id, game, message in rows:
+            result.setdefault(user_id, { })[game] = message
+        return result
+
+    def record(self, user_id: str, date: str, results: Dict[str, str]) -> None:
+        """Add the claimed games and their result text in the background, entries older than a week are dropped on the way"""
+        rows = [(user_id, date, game, time.time(), message) for game, message in results.items()]
+        background_writer.submit(('claim_ledger', user_id, date), lambda: self.__insert(rows))
+
+    def markReported(self, user_id: str, date: str) -> None:
+        """Record in the background that the results of `user_id` on `date` were posted"""
+        rows = [(user_id, date, self.REPORTED, time.time(), None)]
+        background_writer.submit(('claim_ledger', user_id, date, self.REPORTED), lambda: self.__insert(rows))
+
+    def __insert(self, rows: List[tuple]) -> None:
+        with self.__lock, self.__conn:
+            self.__conn.executemany('INSERT OR IGNORE INTO claim_ledger (user_id, date, game, created, message) VALUES (?, ?, ?, ?, ?)', rows)
+            self.__conn.execute('DELETE FROM claim_ledger WHERE created < ?', (time.time() - 7 * 86400,))
+
+class UserLastUseTime:
+    """Last used time of each user, kept in memory as `{int user_id: int epoch}` and shared between processes in the `last_use` table.
+
+    Every change is first appended to this process' journal of fixed-size `(user_id, epoch)` records
+    (epoch 0 marks a deletion) by the background writer, `save()` writes only the users changed since the last save
+    into the table and truncates the journal, so the persistence cost follows the number of updates instead of the number of users
+    """
+    __record = struct.Struct('<QI')
+    __min_interval = 60 # Updates within this many seconds of the previous one are not recorded
+
+    def __init__(self, filename: str, journal_filename: str) -> None:
+        self.__journal_filename = journal_filename
+        self.__conn_lock = threading.Lock()
+        self.__conn = connectSQLite(filename)
+        self.__conn.execute('CREATE TABLE IF NOT EXISTS last_use (user_id INTEGER PRIMARY KEY, epoch INTEGER)')
+        self.data: dict[int, int] = dict(self.__conn.execute('SELECT user_id, epoch FROM last_use').fetchall())
+        # user_id -> epoch (0 to delete) changed since the last save, and the saved changes not yet written into the table
+        self.__dirty: dict[int, int] = { }
+        self.__saving: dict[int, int] = { }
+        if len(self.data) == 0:
+            self.__migrateLegacy()
+        self.__replayJournal(journal_filename)
+        self.__journal = open(journal_filename, 'ab', buffering=0)
+        self.__journal_buffer = bytearray()
+        self.__journal_lock = threading.Lock()
+        # Expiry index: min-heap of (last use epoch, user_id), outdated entries are skipped lazily
+        self.__expiry_heap: List[Tuple[int, int]] = []
+        self.__rebuildIndex()
+
+    def update(self, user_id: str) -> None:
+        """Update user last used time"""
+        id, now = int(user_id), int(time.time())
+        if now - self.data.get(id, 0) < self.__min_interval:
+            return
+        self.__set(id, now)
+        self.__append(id, now)
+
+    def addMissingUsers(self, user_ids: Iterable[str]) -> None:
+        """Users without a last used time are treated as used now"""
+        for user_id in user_ids:
+            if int(user_id) not in self.data:
+                self.update(user_id)
+    
+    def deleteUser(self, user_id: str) -> None:
+        if self.data.pop(int(user_id), None) != None:
+            self.__dirty[int(user_id)] = 0
+            self.__append(int(user_id), 0)
+
+    async def popExpired(self, now: datetime, diff_days: int = 30) -> Tuple[List[str], int]:
+        """Remove and return the users that have not used the service for more than `diff_days` days,
+        only the index entries older than the cutoff are examined.
+        Candidates are checked against the table first (read in a worker thread), since other processes may have seen a newer use
+
+        ------
+        Parameters
+        now `datetime`: the current time
+        diff_days `int`: how many days the difference is
+        ------
+        Returns
+        `list[str]`: the expired user IDs
+        `int`: number of index entries examined
+        """
+        cutoff = (now - timedelta(days=diff_days + 1)).timestamp()
+        candidates: List[Tuple[int, int]] = []
+        examined = 0
+        while len(self.__expiry_heap) > 0 and self.__expiry_heap[0][0] <= cutoff:
+            epoch, id = heapq.heappop(self.__expiry_heap)
+            examined += 1
+            # Skip entries of deleted users and entries replaced by a newer use
+            if self.data.get(id) == epoch:
+                candidates.append((id, epoch))
+        shared = await asyncio.to_thread(self.__loadMany, [id for id, epoch in candidates])
+        expired: List[str] = []
+        for id, epoch in candidates:
+            # Used again or deleted while the table was read
+            if self.data.get(id) != epoch:
+                continue
+            if shared.get(id, 0) > epoch:
+                self.__set(id, shared[id], dirty=False)
+                continue
+            self.deleteUser(str(id))
+            expired.append(str(id))
+        return expired, examined
+
+    async def run(self, interval: float) -> None:
+        """`save()` every `interval` seconds until cancelled, every process runs it so the shared table sees all uses"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.save()
+            except Exception as e:
+                log.error(f'[exception][System]UserLastUseTime > run: {e}')
+
+    def save(self) -> None:
+        """Write the users changed since the last save into the table and truncate the journal, in the background"""
+        if len(self.__dirty) == 0:
+            return
+        with self.__journal_lock:
+            self.__saving.update(self.__dirty)
+        self.__dirty = { }
+        background_writer.submit(('last_use', self.__journal_filename), self.__writeChanges)
+
+    def __set(self, id: int, epoch: int, *, dirty: bool = True) -> None:
+        self.data[id] = epoch
+        if dirty:
+            self.__dirty[id] = epoch
+        heapq.heappush(self.__expiry_heap, (epoch, id))
+        if len(self.__expiry_heap) > 2 * len(self.data) + 1024:
+            self.__rebuildIndex()
+
+    def __append(self, id: int, epoch: int) -> None:
+        with self.__journal_lock:
+            self.__journal_buffer += self.__record.pack(id, epoch)
+        background_writer.submit(('journal', self.__journal_filename), self.__writeJournal)
+
+    def __writeJournal(self) -> None:
+        with self.__journal_lock:
+            buffer = bytes(self.__journal_buffer)
+            self.__journal_buffer.clear()
+        self.__journal.write(buffer)
+
+    def __writeChanges(self) -> None:
+        with self.__journal_lock:
+            changes, self.__saving = self.__saving, { }
+        with self.__conn_lock, self.__conn:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            # Never move a user's time backwards, another process may have written a newer one
+            self.__conn.executemany(
+                'INSERT INTO last_use (user_id, epoch) VALUES (?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET epoch=MAX(epoch, excluded.epoch)',
+                [(id, epoch) for id, epoch in changes.items() if epoch != 0])
+            self.__conn.executemany('DELETE FROM last_use WHERE user_id = ?', [(id,) for id, epoch in changes.items() if epoch == 0])
+        # Every record of the journal is now in the table, replaying it again would be harmless anyway
+        self.__journal.truncate(0)
+
+    def __loadMany(self, ids: List[int]) -> dict[int, int]:
+        result: dict[int, int] = { }
+        with self.__conn_lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i+500]
+                result.update(self.__conn.execute(
+                    f'SELECT user_id, epoch FROM last_use WHERE user_id IN ({",".join("?" * len(chunk))})', chunk).fetchall())
+        return result
+
+    def __replayJournal(self, filename: str) -> None:
+        try:
+            with open(filename, 'rb') as f:
+                buffer = f.read()
+        except FileNotFoundError:
+            return
+        # A torn record at the end of the journal is ignored
+        size = len(buffer) - len(buffer) % self.__record.size
+        for id, epoch in self.__record.iter_unpack(buffer[:size]):
+            if epoch == 0:
+                self.data.pop(id, None)
+            else:
+                self.data[id] = epoch
+            self.__dirty[id] = epoch
+
+    def __migrateLegacy(self) -> None:
+        """Import the legacy `last_use_time.json` of ISO strings, or the binary snapshot and journal of the single-process version"""
+        if os.path.exists('data/last_use_time.bin'):
+            with open('data/last_use_time.bin', 'rb') as f:
+                buffer = f.read()
+            size = len(buffer) - len(buffer) % self.__record.size
+            for id, epoch in self.__record.iter_unpack(buffer[:size]):
+                self.data[id] = self.__dirty[id] = epoch
+            self.__replayJournal('data/last_use_time.journal')
+            return
+        try:
+            with open('data/last_use_time.json', 'r', encoding="utf-8") as f:
+                legacy: dict[str, str] = json.load(f)
+        except:
+            return
+        for user_id, last_time in legacy.items():
+            try:
+                self.data[int(user_id)] = self.__dirty[int(user_id)] = int(datetime.fromisoformat(last_time).timestamp())
+            except ValueError:
+                log.error(f'[exception][System]UserLastUseTime > __migrateLegacy: invalid time {last_time} of {user_id}')
+
+    def __rebuildIndex(self) -> None:
+        index = [(epoch, id) for id, epoch in self.data.items()]
+        heapq.heapify(index)
+        self.__expiry_heap = index
+
+__user_last_use_time: Optional[UserLastUseTime] = None
+
+def getUserLastUseTime() -> UserLastUseTime:
+    """The last used times of this process (journal per `config.process_name`), loaded on first use instead of at import"""
+    global __user_last_use_time
+    if __user_last_use_time == None:
+        __user_last_use_time = UserLastUseTime(config.database_file, f'data/last_use_time.{config.process_name}.journal')
+    return __user_last_use_time
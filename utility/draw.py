@@ -39,16 +39,28 @@ def drawRecordCard(avatar_bytes: bytes, record_card: genshin.models.RecordCard,
     Returns
     `BytesIO`: The completed image is stored in memory, and the file pointer is returned. Before accessing, `seek(0) is required.`
     """
+    img = drawRecordCardBackground()
+    img = drawRecordCardAvatar(img, avatar_bytes)
+    return drawRecordCardStats(img, record_card, user_stats)
+
+def drawRecordCardBackground() -> Image.Image:
+    """First step of `drawRecordCard`, needs no data: a random background with the translucent panels"""
     img = Image.open(f'data/image/record_card/{random.randint(1, 12)}.jpg')
     
     img = img.convert('RGBA')
 
-    avatar = avatar = Image.open(BytesIO(avatar_bytes)).resize((250, 250))
-    drawAvatar(img, avatar, (70, 235))
-
     drawRoundedRect(img, (340, 270, 990, 460), radius=30, fill=(0, 0, 0, 120))
     drawRoundedRect(img, (90, 520, 990, 1730), radius=30, fill=(0, 0, 0, 120))
+    return img
+
+def drawRecordCardAvatar(img: Image.Image, avatar_bytes: bytes) -> Image.Image:
+    """Second step of `drawRecordCard`: the Discord avatar"""
+    avatar = Image.open(BytesIO(avatar_bytes)).resize((250, 250))
+    drawAvatar(img, avatar, (70, 235))
+    return img
 
+def drawRecordCardStats(img: Image.Image, record_card: genshin.models.RecordCard, user_stats: genshin.models.PartialGenshinUserStats) -> BytesIO:
+    """Last step of `drawRecordCard`: the Hoyolab data, returns the encoded image"""
     white = (255, 255, 255, 255)
     grey = (230, 230, 230, 255)
 
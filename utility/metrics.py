@@ -0,0 +1,43 @@
+import threading
+from typing import Dict
+
+class Metrics:
+    """In-process counters, gauges and timings, shown with the `/status` command"""
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.counters: Dict[str, int] = { }
+        self.gauges: Dict[str, float] = { }
+        # name -> [count, total seconds, max seconds]
+        self.timings: Dict[str, list] = { }
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def setGauge(self, name: str, value: float) -> None:
+        with self.__lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record one timing sample in seconds"""
+        with self.__lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def ratio(self, numerator: str, denominator: str) -> float:
+        """Ratio between two counters, 0 when the denominator is empty"""
+        with self.__lock:
+            total = self.counters.get(denominator, 0)
+            return self.counters.get(numerator, 0) / total if total > 0 else 0.0
+
+    def summary(self) -> str:
+        with self.__lock:
+            lines = [f'{name}: {value}' for name, value in sorted(self.counters.items())]
+            lines += [f'{name}: {value}' for name, value in sorted(self.gauges.items())]
+            lines += [f'{name}: n={count} avg={total / count * 1000:.1f}ms max={peak * 1000:.1f}ms'
+                for name, (count, total, peak) in sorted(self.timings.items()) if count > 0]
+        return '\n'.join(lines)
+
+metrics = Metrics()
@@ -0,0 +1,50 @@
+import discord
+from .config import config
+from .cache import TTLCache, SingleFlight
+from .database import ResponseCache
+from .ratelimit import TokenBucket
+
+class DisplayNameResolver:
+    """Display names of users by ID, for scheduled messages that must not ping them.
+
+    Looks in the gateway cache of the bot first, then in a memory and a persistent cache (`display_name_ttl` seconds),
+    and only then asks the Discord REST API: concurrent lookups of one user share a request and requests are paced
+    at `display_name_fetch_rate` per second. Name changes seen by `update()` (user/member update events) refresh the caches
+    """
+    def __init__(self) -> None:
+        self.__memory = TTLCache('display_names', config.display_name_cache_size, config.display_name_ttl)
+        self.__persistent = ResponseCache('display_name_cache', config.database_file, config.display_name_cache_size)
+        self.__flights = SingleFlight('display_name_fetch')
+        self.__bucket = TokenBucket('discord.fetch_user', config.display_name_fetch_rate, config.display_name_fetch_rate)
+
+    async def resolve(self, bot: discord.Client, user_id: int) -> str:
+        """The display name of the user, raises `discord.NotFound` / `discord.HTTPException` when the REST lookup fails"""
+        if (user := bot.get_user(user_id)) != None:
+            return user.display_name
+        if (name := self.__memory.get(user_id)) != None:
+            return name
+        if (name := await self.__persistent.get(str(user_id))) != None:
+            self.__memory.set(user_id, name)
+            return name
+        return await self.__flights.do(user_id, lambda: self.__fetch(bot, user_id))
+
+    def update(self, user: discord.abc.User) -> None:
+        """Refresh the cached name of a user that was looked up before"""
+        if (name := self.__memory.peek(user.id)) != None:
+            if name != user.display_name:
+                self.__store(user.id, user.display_name)
+        else:
+            # The name may still be in the persistent cache (looked up before a restart or by another process)
+            self.__persistent.replace(str(user.id), user.display_name, config.display_name_ttl)
+
+    async def __fetch(self, bot: discord.Client, user_id: int) -> str:
+        await self.__bucket.acquire()
+        user = await bot.fetch_user(user_id)
+        self.__store(user_id, user.display_name)
+        return user.display_name
+
+    def __store(self, user_id: int, name: str) -> None:
+        self.__memory.set(user_id, name)
+        self.__persistent.set(str(user_id), name, str(user_id), config.display_name_ttl)
+
+display_names = DisplayNameResolver()
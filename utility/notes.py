@@ -0,0 +1,68 @@
+import math
+import time
+import datetime
+from typing import Optional
+import genshin
+
+RESIN_RECOVERY_SECONDS = 8 * 60
+
+class NotesSnapshot:
+    """Real-time notes of a uid as returned by Hoyolab, together with the time they were fetched.
+    Resin, realm currency, transformer and expeditions only move forward with time,
+    so the current values can be extrapolated from the snapshot without asking Hoyolab again"""
+    __slots__ = ('notes', 'taken')
+
+    def __init__(self, notes: genshin.models.Notes, taken: Optional[float] = None) -> None:
+        self.notes = notes
+        self.taken = time.time() if taken == None else taken
+
+    def age(self, now: Optional[float] = None) -> float:
+        return (time.time() if now == None else now) - self.taken
+
+    def extrapolate(self, now: Optional[float] = None) -> genshin.models.Notes:
+        """The notes as they should be at `now`, values the player can change by playing (commissions, discounts) are kept"""
+        elapsed = datetime.timedelta(seconds=max(0.0, self.age(now)))
+        notes = self.notes
+        zero = datetime.timedelta(0)
+
+        resin_remaining = max(zero, notes.remaining_resin_recovery_time - elapsed)
+        # One resin every 8 minutes, the last one is completed exactly at the recovery time
+        resin = max(notes.current_resin, notes.max_resin - math.ceil(resin_remaining.total_seconds() / RESIN_RECOVERY_SECONDS))
+
+        # Realm currency has no fixed rate (it depends on the trust rank), assume it is linear until the recovery time
+        currency_remaining = max(zero, notes.remaining_realm_currency_recovery_time - elapsed)
+        currency = notes.current_realm_currency
+        if notes.remaining_realm_currency_recovery_time > zero and currency < notes.max_realm_currency:
+            gained = (notes.max_realm_currency - currency) * (elapsed / notes.remaining_realm_currency_recovery_time)
+            currency = min(notes.max_realm_currency, currency + int(gained))
+
+        transformer = notes.remaining_transformer_recovery_time
+        if transformer != None:
+            transformer = type(transformer)(seconds=max(zero, transformer - elapsed).total_seconds())
+
+        expeditions = []
+        for expedition in notes.expeditions:
+            remaining = max(zero, expedition.remaining_time - elapsed)
+            expeditions.append(expedition.copy(update={
+                'remaining_time': remaining,
+                'status': 'Finished' if remaining <= zero else expedition.status
+            }))
+
+        return notes.copy(update={
+            'current_resin': resin,
+            'remaining_resin_recovery_time': resin_remaining,
+            'current_realm_currency': currency,
+            'remaining_realm_currency_recovery_time': currency_remaining,
+            'remaining_transformer_recovery_time': transformer,
+            'expeditions': expeditions
+        })
+
+    def resinReachTime(self, resin: int) -> float:
+        """Earliest unix time at which the original resin can reach `resin` by natural recovery,
+        a `resin` above the cap is taken as full resin"""
+        notes = self.notes
+        resin = min(resin, notes.max_resin)
+        if notes.current_resin >= resin:
+            return self.taken
+        full = self.taken + notes.remaining_resin_recovery_time.total_seconds()
+        return full - max(0, notes.max_resin - resin) * RESIN_RECOVERY_SECONDS
@@ -0,0 +1,126 @@
+import asyncio
+import discord
+from typing import Callable, Dict, List, Optional
+from .config import config
+from .metrics import metrics
+from .ratelimit import TokenBucket
+from .utils import log
+
+# Discord message limits
+MAX_CONTENT_LENGTH = 2000
+MAX_EMBEDS = 10
+MAX_EMBED_LENGTH = 6000
+
+class OutboxItem:
+    """One line of a batched message, optionally with an embed"""
+    __slots__ = ('line', 'embed', 'mention', 'on_error')
+
+    def __init__(self, line: str, embed: Optional[discord.Embed], mention: Optional[int], on_error: Optional[Callable[[], None]]) -> None:
+        self.line = line[:MAX_CONTENT_LENGTH]
+        self.embed = embed
+        self.mention = mention
+        self.on_error = on_error
+
+class Outbox:
+    """Groups the messages of the schedule by channel.
+
+    Lines posted to a channel within `outbox_flush_delay` seconds are packed into as few messages as
+    Discord's content and embed limits allow, only the users given as `mention` are pinged.
+    Sends are paced by a bucket per channel and a global one so a busy channel does not stall on Discord's rate limits
+    """
+    def __init__(self) -> None:
+        self.__pending: Dict[int, List[OutboxItem]] = { }
+        self.__tasks: Dict[int, asyncio.Task] = { }
+        self.__buckets: Dict[int, TokenBucket] = { }
+        self.__global = TokenBucket('discord', config.outbox_global_rate, config.outbox_global_rate)
+
+    def post(self, channel: discord.abc.Messageable, line: str, *, embed: Optional[discord.Embed] = None,
+            mention: Optional[int] = None, on_error: Optional[Callable[[], None]] = None) -> None:
+        """Queue a line for the channel
+
+        ------
+        Parameters
+        channel `Messageable`: destination channel
+        line `str`: text of the line, it should contain `<@{mention}>` when the user is to be pinged
+        embed `Embed`: embed sent with the line
+        mention `int`: ID of the user that may be pinged by the line
+        on_error `Callable`: called when the channel is gone or the bot may not send there (not on transient errors)
+        """
+        self.__pending.setdefault(channel.id, []).append(OutboxItem(line, embed, mention, on_error))
+        metrics.increment('outbox.items')
+        if (task := self.__tasks.get(channel.id)) == None or task.done():
+            self.__tasks[channel.id] = asyncio.create_task(self.__deliver(channel))
+
+    async def flush(self) -> None:
+        """Wait until everything queued so far is sent"""
+        while len(tasks := [task for task in self.__tasks.values() if not task.done()]) > 0:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __deliver(self, channel: discord.abc.Messageable) -> None:
+        try:
+            while len(self.__pending.get(channel.id, [])) > 0:
+                # Let the other results of the run join the batch
+                await asyncio.sleep(config.outbox_flush_delay)
+                items = self.__pending.pop(channel.id, [])
+                for batch in packMessages(items):
+                    await self.__bucket(channel.id).acquire()
+                    await self.__global.acquire()
+                    await self.__send(channel, batch)
+        finally:
+            self.__tasks.pop(channel.id, None)
+            self.__buckets = {channel_id: bucket for channel_id, bucket in self.__buckets.items() if not bucket.idle}
+
+    async def __send(self, channel: discord.abc.Messageable, batch: List[OutboxItem]) -> None:
+        """Send one message. Only a channel that is gone or forbidden reports `on_error` to its items,
+        other errors (server errors, network) are retried `outbox_send_attempts` times, then the message is dropped"""
+        mentions = [discord.Object(item.mention) for item in batch if item.mention != None]
+        embeds = [item.embed for item in batch if item.embed != None]
+        for attempt in range(1, config.outbox_send_attempts + 1):
+            try:
+                await channel.send('\n'.join(item.line for item in batch), embeds=embeds,
+                    allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=mentions))
+                metrics.increment('outbox.messages')
+                return
+            except (discord.Forbidden, discord.NotFound) as e:
+                metrics.increment('outbox.failed')
+                log.error(f'[exception][System]Outbox > __send(channel={channel.id}): {e}')
+                for item in batch:
+                    if item.on_error != None:
+                        item.on_error()
+                return
+            except Exception as e:
+                log.error(f'[exception][System]Outbox > __send(channel={channel.id}) attempt {attempt}: {e}')
+                if attempt < config.outbox_send_attempts:
+                    await asyncio.sleep(2 ** attempt)
+        metrics.increment('outbox.dropped')
+
+    def __bucket(self, channel_id: int) -> TokenBucket:
+        if (bucket := self.__buckets.get(channel_id)) == None:
+            bucket = self.__buckets[channel_id] = TokenBucket('discord.channel', config.outbox_channel_rate, config.outbox_channel_burst)
+        return bucket
+
+def packMessages(items: List[OutboxItem]) -> List[List[OutboxItem]]:
+    """Split the items into messages within the content length, embed count and total embed length limits, keeping their order"""
+    batches: List[List[OutboxItem]] = []
+    batch: List[OutboxItem] = []
+    length, embeds, embed_length = 0, 0, 0
+    for item in items:
+        item_length = len(item.line) + (1 if len(batch) > 0 else 0)
+        item_embed_length = len(item.embed) if item.embed != None else 0
+        if len(batch) > 0 and (
+                length + item_length > MAX_CONTENT_LENGTH or
+                embeds + int(item.embed != None) > MAX_EMBEDS or
+                embed_length + item_embed_length > MAX_EMBED_LENGTH):
+            batches.append(batch)
+            batch = []
+            length, embeds, embed_length = 0, 0, 0
+            item_length = len(item.line)
+        batch.append(item)
+        length += item_length
+        embeds += int(item.embed != None)
+        embed_length += item_embed_length
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+outbox = Outbox()
@@ -0,0 +1,59 @@
+import time
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, Sequence, Tuple
+from .metrics import metrics
+
+class Pipeline:
+    """Run the stages of a command that gathers data from several sources.
+
+    Every stage starts as soon as the stages it depends on are done, so independent fetches run concurrently.
+    A stage is called with the results of its dependencies in order on the event loop and an awaitable result is awaited;
+    stages added with `thread=True` (CPU-bound image drawing) run in a worker thread instead. The time of each stage is recorded as
+    `pipeline.{name}.{stage}` and the whole run as `pipeline.{name}`
+
+    Example:
+    ```
+    results = await Pipeline('card') \\
+        .add('data', fetchData) \\
+        .add('avatar', fetchAvatar) \\
+        .add('image', drawImage, after=('data', 'avatar'), thread=True) \\
+        .run()
+    ```
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.__stages: Dict[str, Tuple[Callable[..., Any], Sequence[str], bool]] = { }
+
+    def add(self, stage: str, fn: Callable[..., Any], *, after: Sequence[str] = (), thread: bool = False) -> 'Pipeline':
+        for dependency in after:
+            if dependency not in self.__stages:
+                raise ValueError(f'Pipeline {self.name}: stage {stage} depends on unknown stage {dependency}')
+        self.__stages[stage] = (fn, tuple(after), thread)
+        return self
+
+    async def run(self) -> Dict[str, Any]:
+        """Run every stage and return their results by stage name.
+        When a stage fails the stages that are still running are cancelled and the exception is raised"""
+        start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = { }
+        for stage, (fn, after, thread) in self.__stages.items():
+            tasks[stage] = asyncio.create_task(self.__runStage(stage, fn, thread, [tasks[dependency] for dependency in after]))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        metrics.observe(f'pipeline.{self.name}', time.perf_counter() - start)
+        return {stage: task.result() for stage, task in tasks.items()}
+
+    async def __runStage(self, stage: str, fn: Callable[..., Any], thread: bool, dependencies: Sequence[asyncio.Task]) -> Any:
+        args = [await task for task in dependencies]
+        start = time.perf_counter()
+        result = await asyncio.to_thread(fn, *args) if thread else fn(*args)
+        # Coroutine functions, and e.g. lambdas returning a coroutine
+        if inspect.isawaitable(result):
+            result = await result
+        metrics.observe(f'pipeline.{self.name}.{stage}', time.perf_counter() - start)
+        return result
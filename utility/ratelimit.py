@@ -0,0 +1,97 @@
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Dict, Hashable, List, Optional, Tuple
+from .config import config
+from .metrics import metrics
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average with bursts of up to `capacity`.
+    Waiting callers are served in order of `priority` (lower first), then first come first served"""
+    def __init__(self, name: str, rate: float, capacity: float) -> None:
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = capacity
+        self.__updated = time.monotonic()
+        # (priority, seq, future)
+        self.__waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.__seq = itertools.count()
+        self.__dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def idle(self) -> bool:
+        """No one is waiting and the bucket is full again, it can be dropped"""
+        self.__refill()
+        return len(self.__waiters) == 0 and self.__tokens >= self.capacity
+
+    async def acquire(self, priority: int = 0) -> None:
+        self.__refill()
+        if len(self.__waiters) == 0 and self.__tokens >= 1:
+            self.__tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.__waiters, (priority, next(self.__seq), future))
+        metrics.setGauge(f'ratelimit.{self.name}.queue', len(self.__waiters))
+        if self.__dispatcher == None or self.__dispatcher.done():
+            self.__dispatcher = asyncio.create_task(self.__dispatch())
+        start = time.monotonic()
+        await future
+        metrics.observe(f'ratelimit.{self.name}.wait', time.monotonic() - start)
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+        self.__updated = now
+
+    async def __dispatch(self) -> None:
+        while len(self.__waiters) > 0:
+            self.__refill()
+            if self.__tokens < 1:
+                await asyncio.sleep((1 - self.__tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self.__waiters)
+            metrics.setGauge(f'ratelimit.{self.name}.queue', len(self.__waiters))
+            # Callers that were cancelled while waiting do not use a token
+            if not future.done():
+                self.__tokens -= 1
+                future.set_result(None)
+
+class RateLimiter:
+    """Budget of the Hoyolab requests: a global bucket, one bucket per endpoint and one per account.
+    Endpoints listed in `config.ratelimit_account_cooldowns` can only be called once per cooldown by each account"""
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    def __init__(self) -> None:
+        self.__global = TokenBucket('global', config.ratelimit_global_rate, config.ratelimit_global_burst)
+        self.__endpoints: Dict[str, TokenBucket] = {
+            endpoint: TokenBucket(endpoint, rate, burst) for endpoint, (rate, burst) in config.ratelimit_endpoints.items()
+        }
+        self.__accounts: Dict[Hashable, TokenBucket] = { }
+
+    async def acquire(self, endpoint: str, account: Optional[int] = None, priority: int = INTERACTIVE) -> None:
+        """Wait until a request to `endpoint` for `account` fits every budget.
+        Background work (the schedule) uses `BACKGROUND` so interactive commands go first"""
+        if account != None:
+            await self.__accountBucket(account, None).acquire(priority)
+            if endpoint in config.ratelimit_account_cooldowns:
+                await self.__accountBucket(account, endpoint).acquire(priority)
+        if (bucket := self.__endpoints.get(endpoint)) != None:
+            await bucket.acquire(priority)
+        await self.__global.acquire(priority)
+
+    def __accountBucket(self, account: int, endpoint: Optional[str]) -> TokenBucket:
+        key = (account, endpoint)
+        if (bucket := self.__accounts.get(key)) == None:
+            if len(self.__accounts) >= config.ratelimit_max_accounts:
+                self.__accounts = {k: b for k, b in self.__accounts.items() if not b.idle}
+            if endpoint == None:
+                bucket = TokenBucket('account', config.ratelimit_account_rate, config.ratelimit_account_burst)
+            else:
+                bucket = TokenBucket(f'cooldown.{endpoint}', 1 / config.ratelimit_account_cooldowns[endpoint], 1)
+            self.__accounts[key] = bucket
+        return bucket
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,46 @@
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+class ReminderQueue:
+    """Min-heap of the next check time (unix seconds) of each user.
+
+    Rescheduling a user only pushes a new entry, entries that no longer match `due` are skipped when popped
+    """
+    def __init__(self) -> None:
+        self.__heap: List[Tuple[float, str]] = []
+        self.due: Dict[str, float] = { }
+
+    def schedule(self, user_id: str, due: float) -> None:
+        self.due[user_id] = due
+        heapq.heappush(self.__heap, (due, user_id))
+        # Drop the stale entries once they outnumber the live ones
+        if len(self.__heap) > 2 * len(self.due) + 64:
+            self.__heap = [(due, user_id) for user_id, due in self.due.items()]
+            heapq.heapify(self.__heap)
+
+    def remove(self, user_id: str) -> None:
+        self.due.pop(user_id, None)
+
+    def nextDue(self) -> Optional[float]:
+        """The earliest check time, `None` when no user is scheduled"""
+        while len(self.__heap) > 0:
+            due, user_id = self.__heap[0]
+            if self.due.get(user_id) == due:
+                return due
+            heapq.heappop(self.__heap)
+        return None
+
+    def popDue(self, now: float) -> List[str]:
+        """Remove and return the users whose check time has come"""
+        result = []
+        while (due := self.nextDue()) != None and due <= now:
+            _, user_id = heapq.heappop(self.__heap)
+            del self.due[user_id]
+            result.append(user_id)
+        return result
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.due
+
+    def __len__(self) -> int:
+        return len(self.due)
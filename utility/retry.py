@@ -0,0 +1,63 @@
+import time
+import random
+import asyncio
+import aiohttp
+import genshin
+from typing import Any, Awaitable, Callable, Dict
+from .config import config, RetryPolicyConfig
+from .metrics import metrics
+from .utils import log
+
+class DeadlineExceeded(Exception):
+    """The call and its retries did not finish within the deadline"""
+    def __init__(self, endpoint: str) -> None:
+        super().__init__(f'Hoyolab did not respond in time ({endpoint}), please try again later')
+
+class RetryPolicy:
+    """Retry an upstream call on transient failures with capped exponential backoff and full jitter, within a total deadline.
+    Retries are counted as `retry.{name}.retries`, calls that succeeded after retrying as `retry.{name}.recovered`
+    and calls that still failed after retrying as `retry.{name}.exhausted`"""
+    def __init__(self, name: str, policy: RetryPolicyConfig) -> None:
+        self.name = name
+        self.policy = policy
+
+    def isRetryable(self, e: Exception) -> bool:
+        if isinstance(e, genshin.errors.GenshinException):
+            return e.retcode in self.policy.retcodes
+        return self.policy.network_errors and isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+    async def run(self, call: Callable[[], Awaitable[Any]], *, background: bool = False) -> Any:
+        """Await `call()` until it succeeds, fails with a non-retryable error or runs out of attempts or time.
+        Raises `DeadlineExceeded` when the deadline cuts an attempt short"""
+        deadline = time.monotonic() + (config.retry_background_deadline if background else self.policy.deadline)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await asyncio.wait_for(call(), deadline - time.monotonic())
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and time.monotonic() >= deadline:
+                    metrics.increment(f'retry.{self.name}.deadline')
+                    raise DeadlineExceeded(self.name) from None
+                if not self.isRetryable(e):
+                    raise
+                delay = random.uniform(0, min(self.policy.max_delay, self.policy.base_delay * 2 ** (attempt - 1)))
+                if attempt >= self.policy.attempts or time.monotonic() + delay >= deadline:
+                    if attempt > 1:
+                        metrics.increment(f'retry.{self.name}.exhausted')
+                    raise
+                metrics.increment(f'retry.{self.name}.retries')
+                log.info(f'[retry][System]RetryPolicy > {self.name}: attempt {attempt} failed ({type(e).__name__}: {e}), retry in {delay:.2f}s')
+                await asyncio.sleep(delay)
+            else:
+                if attempt > 1:
+                    metrics.increment(f'retry.{self.name}.recovered')
+                return result
+
+__policies: Dict[str, RetryPolicy] = { }
+
+def getRetryPolicy(endpoint: str) -> RetryPolicy:
+    """The policy configured for `endpoint` in `config.retry_policies`, or the default one"""
+    if (policy := __policies.get(endpoint)) == None:
+        policy = __policies[endpoint] = RetryPolicy(endpoint, config.retry_policies.get(endpoint, config.retry_policies.get('default', RetryPolicyConfig())))
+    return policy
@@ -0,0 +1,46 @@
+from typing import List, Sequence, Tuple
+import genshin
+
+class CharacterSummary:
+    """The fields of a `genshin.models.Character` shown by `/my_characters`, small enough to cache the whole roster of a uid"""
+    __slots__ = ('name', 'element', 'rarity', 'icon', 'level', 'friendship', 'constellation', 'weapon', 'constellations', 'artifacts')
+
+    def __init__(self, name: str, element: str, rarity: int, icon: str, level: int, friendship: int, constellation: int,
+            weapon: Tuple[str, int, int, int], constellations: List[Tuple[int, str]], artifacts: List[Tuple[str, str, str]]) -> None:
+        self.name = name
+        self.element = element
+        self.rarity = rarity
+        self.icon = icon
+        self.level = level
+        self.friendship = friendship
+        self.constellation = constellation
+        # (name, rarity, refinement, level)
+        self.weapon = weapon
+        # (pos, name) of the activated constellations
+        self.constellations = constellations
+        # (pos_name, name, set name)
+        self.artifacts = artifacts
+
+    @classmethod
+    def fromCharacter(cls, character: genshin.models.Character) -> 'CharacterSummary':
+        weapon = character.weapon
+        return cls(
+            character.name, character.element, character.rarity, character.icon,
+            character.level, character.friendship, character.constellation,
+            (weapon.name, weapon.rarity, weapon.refinement, weapon.level),
+            [(c.pos, c.name) for c in character.constellations if c.activated],
+            [(a.pos_name, a.name, a.set.name) for a in character.artifacts])
+
+    @classmethod
+    def fromList(cls, data: list) -> 'CharacterSummary':
+        """Build from the JSON form written by `toList`"""
+        name, element, rarity, icon, level, friendship, constellation, weapon, constellations, artifacts = data
+        return cls(name, element, rarity, icon, level, friendship, constellation,
+            tuple(weapon), [tuple(c) for c in constellations], [tuple(a) for a in artifacts])
+
+    def toList(self) -> list:
+        return [self.name, self.element, self.rarity, self.icon, self.level, self.friendship, self.constellation,
+            list(self.weapon), [list(c) for c in self.constellations], [list(a) for a in self.artifacts]]
+
+def parseRoster(data: Sequence[list]) -> List[CharacterSummary]:
+    return [CharacterSummary.fromList(item) for item in data]
@@ -0,0 +1,14 @@
+import aiohttp
+from .config import config
+
+def createSession() -> aiohttp.ClientSession:
+    """Create the bot-lifetime HTTP session: keep-alive connections with a per-host limit and a DNS cache.
+    Must be called inside the running event loop, close it on shutdown"""
+    connector = aiohttp.TCPConnector(
+        limit=config.http_connection_limit,
+        limit_per_host=config.http_connection_limit_per_host,
+        ttl_dns_cache=config.http_dns_cache_ttl,
+        keepalive_timeout=config.http_keepalive_timeout
+    )
+    timeout = aiohttp.ClientTimeout(total=config.http_timeout, connect=config.http_connect_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
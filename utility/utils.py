@@ -1,7 +1,6 @@
 import logging
 import genshin
 import re
-import json
 from datetime import datetime
 from data.game.characters import characters_map
 
@@ -48,40 +47,3 @@ def getDayOfWeek(time: datetime) -> str:
     elif delta.days == 1:
         return 'tomorrow'
     return __weekday_dict.get(time.weekday())
-
-class UserLastUseTime:
-    def __init__(self) -> None:
-        try:
-            with open('data/last_use_time.json', 'r', encoding="utf-8") as f:
-                self.data: dict[str, str] = json.load(f)
-        except:
-            self.data: dict[str, str]  = { }
-
-    def update(self, user_id: str) -> None:
-        """Update user last used time"""
-        self.data[user_id] = datetime.now().isoformat()
-    
-    def deleteUser(self, user_id: str) -> None:
-        self.data.pop(user_id, None)
-
-    def checkExpiry(self, user_id: str, now: datetime, diff_days: int = 30) -> bool:
-        """Check if the user has not used the service for a certain period of time
-        param user_id: User Discord ID
-        param now: the current time
-        param diff_days: how many days the difference is
-        """
-        last_time = self.data.get(user_id)
-        if last_time == None:
-            self.update(user_id)
-            return False
-        interval = now - datetime.fromisoformat(last_time)
-        return True if interval.days > diff_days else False
-
-    def save(self) -> None:
-        try:
-            with open('data/last_use_time.json', 'w', encoding="utf-8") as f:
-                json.dump(self.data, f)
-        except Exception as e:
-            log.error(f'[exception][System]UserLastUseTime > save: {e}')
-
-user_last_use_time = UserLastUseTime()
\ No newline at end of file
@@ -0,0 +1,56 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Iterable
+from .metrics import metrics
+from .utils import log
+
+class WorkerPool:
+    """Run `handle(item)` for many items with at most `concurrency` running at once.
+
+    A failing item is logged and does not stop the others, time limits are up to `handle` (e.g. only on the upstream calls).
+    Progress is logged every `progress_interval` seconds, the counts are reported as `workers.{name}.*` metrics
+    """
+    def __init__(self, name: str, concurrency: int, *, progress_interval: float = 60.0) -> None:
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.progress_interval = progress_interval
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+
+    async def run(self, items: Iterable[Any], handle: Callable[[Any], Awaitable[None]]) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+        self.total = queue.qsize()
+        self.done = self.failed = 0
+        start = time.monotonic()
+        progress = asyncio.create_task(self.__logProgress(start))
+        try:
+            await asyncio.gather(*[self.__worker(queue, handle) for _ in range(min(self.concurrency, self.total))])
+        finally:
+            progress.cancel()
+        elapsed = time.monotonic() - start
+        metrics.observe(f'workers.{self.name}.run', elapsed)
+        log.info(f'[schedule][System]{self.name}: {self.done}/{self.total} done in {elapsed:.1f}s, {self.failed} failed')
+
+    async def __worker(self, queue: asyncio.Queue, handle: Callable[[Any], Awaitable[None]]) -> None:
+        while not queue.empty():
+            item = queue.get_nowait()
+            try:
+                await handle(item)
+            except Exception as e:
+                self.failed += 1
+                metrics.increment(f'workers.{self.name}.failed')
+                log.error(f'[exception][System]{self.name}: {item}: {e}')
+            finally:
+                self.done += 1
+                metrics.increment(f'workers.{self.name}.done')
+
+    async def __logProgress(self, start: float) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            elapsed = time.monotonic() - start
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            eta = (self.total - self.done) / rate if rate > 0 else float('inf')
+            log.info(f'[schedule][System]{self.name}: {self.done}/{self.total} done, {rate:.1f}/s, about {eta:.0f}s left')
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import threading
+import logging as log
+from typing import Any, Callable, Dict, Hashable, Optional
+from .metrics import metrics
+
+def writeFileAtomic(filename: str, data: bytes) -> None:
+    """Write to a temporary file first and rename it over the target, a crash never leaves a half-written file"""
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+class BackgroundWriter:
+    """Run blocking persistence work on a background thread instead of the event loop.
+
+    Pending writes are keyed, submitting a key that is still waiting replaces the older write,
+    so several changes to the same file (or the same row) end up as a single write
+    """
+    def __init__(self) -> None:
+        self.__pending: Dict[Hashable, Callable[[], None]] = { }
+        self.__cond = threading.Condition()
+        self.__thread: Optional[threading.Thread] = None
+        self.__busy = False
+        self.__closed = False
+
+    def submit(self, key: Hashable, write: Callable[[], None]) -> None:
+        """Queue `write` to run on the writer thread, replacing the pending write with the same `key`"""
+        with self.__cond:
+            if self.__closed:
+                # After shutdown the write is done right away, so nothing is lost
+                self.__run(key, write)
+                return
+            if self.__pending.pop(key, None) != None:
+                metrics.increment('writer.coalesced')
+            # Re-queued keys move to the end to keep the order of writes
+            self.__pending[key] = write
+            metrics.setGauge('writer.queue_depth', len(self.__pending))
+            if self.__thread == None:
+                self.__thread = threading.Thread(target=self.__worker, name='BackgroundWriter', daemon=True)
+                self.__thread.start()
+            self.__cond.notify_all()
+
+    def writeFile(self, filename: str, data: bytes) -> None:
+        """Atomically replace `filename` with `data` in the background"""
+        self.submit(('file', filename), lambda: writeFileAtomic(filename, data))
+
+    def writeJson(self, filename: str, obj: Any) -> None:
+        """Serialize `obj` now and atomically write it to `filename` in the background"""
+        self.writeFile(filename, json.dumps(obj).encode('utf-8'))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until all pending writes are done, returns `False` on timeout"""
+        with self.__cond:
+            return self.__cond.wait_for(lambda: len(self.__pending) == 0 and not self.__busy, timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Flush-on-shutdown hook: write everything still pending and stop the thread"""
+        self.flush(timeout)
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        if self.__thread != None:
+            self.__thread.join(timeout)
+        log.info('[News][System]BackgroundWriter > close: all pending writes flushed')
+
+    def __worker(self) -> None:
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: len(self.__pending) > 0 or self.__closed)
+                if len(self.__pending) == 0:
+                    return
+                key = next(iter(self.__pending))
+                write = self.__pending.pop(key)
+                metrics.setGauge('writer.queue_depth', len(self.__pending))
+                self.__busy = True
+            self.__run(key, write)
+            with self.__cond:
+                self.__busy = False
+                self.__cond.notify_all()
+
+    def __run(self, key: Hashable, write: Callable[[], None]) -> None:
+        start = time.perf_counter()
+        try:
+            write()
+        except Exception as e:
+            metrics.increment('writer.errors')
+            log.error(f'[exception][System]BackgroundWriter > {key}: {e}')
+        metrics.observe('writer.write_latency', time.perf_counter() - start)
+
+background_writer = BackgroundWriter()